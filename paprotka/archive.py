@@ -0,0 +1,59 @@
+import json
+import numpy as np
+
+MAGIC = b'PAPROTKA'
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_arrays(path, arrays, attributes=None):
+    """Stores named arrays and JSON-serializable attributes in one file. Each array is written raw
+    at an aligned offset, so that load_arrays can memory-map it without copying."""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError('array {} has object dtype and cannot be stored raw'.format(name))
+        offset = _align(offset)
+        entries[name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+        offset += array.nbytes
+
+    header = json.dumps({'arrays': entries, 'attributes': attributes or {}}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    with open(path, 'wb') as opened:
+        opened.write(MAGIC)
+        opened.write(np.uint64(len(header)).tobytes())
+        opened.write(header)
+        for name, array in arrays.items():
+            opened.write(b'\0' * (data_start + entries[name]['offset'] - opened.tell()))
+            opened.write(array.tobytes())
+
+
+def load_arrays(path, mmap=True):
+    """Returns (arrays, attributes) stored by save_arrays. With mmap the arrays are read-only views
+    of the file, so processes loading the same file share its pages."""
+    with open(path, 'rb') as opened:
+        if opened.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not an array archive'.format(path))
+        header_size = int(np.frombuffer(opened.read(8), dtype=np.uint64)[0])
+        header = json.loads(opened.read(header_size).decode('utf-8'))
+        data_start = _align(len(MAGIC) + 8 + header_size)
+
+        arrays = {}
+        for name, entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            shape = tuple(entry['shape'])
+            offset = data_start + entry['offset']
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+            else:
+                opened.seek(offset)
+                arrays[name] = np.fromfile(opened, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    return arrays, header['attributes']
@@ -1,6 +1,18 @@
 import numpy as np
+import pandas as pd
 from scipy import sparse
 from sklearn import base as skbase
+from paprotka.metric import DEFAULT_BLOCK_BYTES, block_rows
+
+
+def factor_products(user_params, item_features, user_positions, item_positions, chunk_size=2 ** 20):
+    """Dot products of user and item factors for pairs of positions, gathered in chunks."""
+    predictions = np.empty(len(user_positions), dtype=np.float64)
+    for start in range(0, len(user_positions), chunk_size):
+        end = start + chunk_size
+        predictions[start:end] = np.einsum('ij,ij->i', user_params[user_positions[start:end]],
+                                           item_features[item_positions[start:end]])
+    return predictions
 
 
 class CollaborativeRecommender(skbase.BaseEstimator):
@@ -9,6 +21,7 @@ class CollaborativeRecommender(skbase.BaseEstimator):
         self.learning_rate = learning_rate
         self.regularization_param = regularization_param
         self.error_ratio_threshold = error_ratio_threshold
+        self.person_ids = None
 
     def get_params(self, deep=True):
         return {
@@ -19,59 +32,130 @@ class CollaborativeRecommender(skbase.BaseEstimator):
         }
 
     def fit(self, train_df, label_df):
-        person_ids = np.unique(train_df.person_id)
-        self.person_pos = {person_id: index for index, person_id in enumerate(person_ids)}
-        user_count = person_ids.size
+        """Gradient descent over the observed ratings only, kept in a sparse users x items matrix,
+        so memory scales with the number of ratings instead of users x items."""
+        self.person_ids = None
+        self.partial_fit(train_df, label_df)
 
+    def partial_fit(self, train_df, label_df, max_iter=None):
+        """Continues training from the current factors on a chunk of ratings, so a fitted model
+        can be warm started and ratings can be streamed in chunks. Persons and movies seen
+        for the first time get new randomly initialized factors. Only the factors of persons
+        and movies in the chunk are updated, until the error converges or for max_iter steps."""
         train_values = train_df.values
-        label_values = label_df.values
-        sparse_matrix = sparse.csr_matrix((label_values, (train_values[:, 0], train_values[:, 1] - 1)), dtype=np.uint8)
-        item_count = sparse_matrix.shape[1]
-
-        exist_values = np.ones_like(label_values)
-        exist_sparse_matrix = sparse.csr_matrix((exist_values, (train_values[:, 0], train_values[:, 1] - 1)),
-                                                dtype=np.bool)
-        exist_count = exist_values.sum()
-
-        train_matrix = np.zeros((user_count, item_count), dtype=np.uint8)
-        exist_matrix = np.zeros((user_count, item_count), dtype=np.uint8)
-        for person_id, index in self.person_pos.items():
-            train_matrix[index] = sparse_matrix.getrow(person_id).toarray()
-            exist_matrix[index] = exist_sparse_matrix.getrow(person_id).toarray()
-        exist_per_user = exist_matrix.sum(axis=1)  # U
-        exist_per_item = exist_matrix.sum(axis=0)  # I
-
-        self.user_params = np.random.rand(user_count, self.feature_count)  # U x W
-        self.item_features = np.random.rand(item_count, self.feature_count)  # I x W
+        label_values = np.ravel(label_df.values).astype(np.float64)
+        self._grow(np.unique(train_values[:, 0]), train_values[:, 1].max())
+
+        users = self.positions(train_values[:, 0])
+        items = train_values[:, 1] - 1
+        chunk_users, local_users = np.unique(users, return_inverse=True)
+        chunk_items, local_items = np.unique(items, return_inverse=True)
+        ratings = sparse.csr_matrix((label_values, (local_users, local_items)),
+                                    shape=(chunk_users.size, chunk_items.size))
+        ratings.sum_duplicates()
+
+        chunk_rated = sparse.csr_matrix((np.ones(users.size, dtype=bool), (users, items)),
+                                        shape=(self.person_ids.size, self.item_features.shape[0]))
+        self.rated.resize(chunk_rated.shape)
+        self.rated = self.rated + chunk_rated  # merges sorted rows, without rebuilding from coordinates
+
+        user_params = self.user_params[chunk_users]
+        item_features = self.item_features[chunk_items]
+        self._descend(user_params, item_features, ratings, max_iter)
+        self.user_params[chunk_users] = user_params
+        self.item_features[chunk_items] = item_features
+
+    def _grow(self, person_ids, max_movie_id):
+        """Makes room for new persons, appended after the known ones, and for movies up to max_movie_id."""
+        if self.person_ids is None:
+            self.person_ids = np.empty(0, dtype=person_ids.dtype)
+            self.person_pos = {}
+            self.user_params = np.empty((0, self.feature_count))
+            self.item_features = np.empty((0, self.feature_count))
+            self.rated = sparse.csr_matrix((0, 0), dtype=bool)
+
+        new_ids = [person_id for person_id in person_ids.tolist() if person_id not in self.person_pos]
+        if new_ids:
+            self.person_pos.update(zip(new_ids, range(self.person_ids.size, self.person_ids.size + len(new_ids))))
+            self.person_ids = np.r_[self.person_ids, np.array(new_ids, dtype=self.person_ids.dtype)]
+            self.user_params = np.r_[self.user_params, np.random.rand(len(new_ids), self.feature_count)]  # U x W
 
+        item_count = self.item_features.shape[0]
+        if max_movie_id > item_count:
+            self.item_features = np.r_[
+                self.item_features, np.random.rand(max_movie_id - item_count, self.feature_count)
+            ]  # I x W
+
+    def _descend(self, user_params, item_features, ratings, max_iter=None):
+        """Full batch gradient descent on factors of the rows and columns of a sparse ratings matrix."""
+        observed = ratings.tocoo()  # same order of entries as ratings.data
+        exist_count = ratings.nnz
+        exist_per_user = np.maximum(np.diff(ratings.indptr), 1)  # U
+        exist_per_item = np.maximum(np.bincount(observed.col, minlength=ratings.shape[1]), 1)  # I
+
+        corrections = ratings.copy()
+        iteration = 0
         prev_total_error = None
         total_error = None
         while prev_total_error is None or abs(
                         (total_error - prev_total_error) / prev_total_error) >= self.error_ratio_threshold:
+            if max_iter is not None and iteration >= max_iter:
+                break
+            iteration += 1
             prev_total_error = total_error
 
-            prediction_corrections = (self.user_params @ self.item_features.T - train_matrix) * exist_matrix  # U x I
-            user_corrections = (prediction_corrections @ self.item_features) / exist_per_user[:, None]  # U x W
-            item_corrections = (prediction_corrections.T @ self.user_params) / exist_per_item[:, None]  # I x W
-            total_error = np.square(prediction_corrections).sum() / exist_count
+            corrections.data = factor_products(user_params, item_features, observed.row, observed.col) \
+                - observed.data  # nnz
+            user_corrections = (corrections @ item_features) / exist_per_user[:, None]  # U x W
+            item_corrections = (corrections.T @ user_params) / exist_per_item[:, None]  # I x W
+            total_error = np.square(corrections.data).sum() / exist_count
 
             if self.regularization_param != 0:
-                user_corrections += self.regularization_param * self.user_params
-                item_corrections += self.regularization_param * self.item_features
+                user_corrections += self.regularization_param * user_params
+                item_corrections += self.regularization_param * item_features
                 total_error += self.regularization_param * (
-                    np.square(self.user_params).sum() + np.square(self.item_features).sum()
+                    np.square(user_params).sum() + np.square(item_features).sum()
                 )
 
-            self.user_params -= self.learning_rate * user_corrections
-            self.item_features -= self.learning_rate * item_corrections
+            user_params -= self.learning_rate * user_corrections
+            item_features -= self.learning_rate * item_corrections
+
+    def _predict_observed(self, user_positions, item_positions):
+        return factor_products(self.user_params, self.item_features, user_positions, item_positions)
+
+    def positions(self, person_ids):
+        """Rows of user_params of person ids, KeyError for persons not seen in fit."""
+        unique_ids, inverse = np.unique(np.asarray(person_ids), return_inverse=True)
+        rows = np.array([self.person_pos[person_id] for person_id in unique_ids.tolist()], dtype=np.intp)
+        return rows[inverse.ravel()]
 
     def predict(self, task_df):
-        def classify_collaborative(task_row):
-            pos = self.person_pos[task_row.person_id]
-            prediction = self.user_params[pos] @ self.item_features[task_row.movie_id - 1].T
-            try:
-                return int(np.clip(round(prediction), 0, 5))
-            except ValueError:
-                return -1
-
-        return task_df.T.apply(classify_collaborative)
\ No newline at end of file
+        users = self.positions(task_df.person_id.values)
+        predictions = self._predict_observed(users, task_df.movie_id.values - 1)
+        ratings = np.full(predictions.size, -1, dtype=np.int64)
+        finite = np.isfinite(predictions)
+        ratings[finite] = np.clip(np.round(predictions[finite]), 0, 5)
+        return pd.Series(ratings, index=task_df.index)
+
+    def recommend(self, person_ids, n=10, block_bytes=DEFAULT_BLOCK_BYTES):
+        """Movie ids of the n best rated movies each person has not rated yet, best first, P x n.
+        Rows are padded with -1 when a person has fewer than n unrated movies."""
+        users = self.positions(person_ids)
+        item_count = self.item_features.shape[0]
+        n = min(n, item_count)
+        recommendations = np.empty((users.size, n), dtype=np.int64)
+        step = block_rows(item_count, block_bytes)
+        for start in range(0, users.size, step):
+            block = users[start:start + step]
+            scores = self.user_params[block] @ self.item_features.T  # B x I
+            seen = self.rated[block].tocoo()
+            scores[seen.row, seen.col] = -np.inf
+
+            best = np.argpartition(-scores, n - 1, axis=1)[:, :n] if n < item_count \
+                else np.broadcast_to(np.arange(item_count), scores.shape)
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            recommendations[start:start + step] = np.where(np.isneginf(best_scores), -1, best + 1)
+        return recommendations
@@ -1,5 +1,8 @@
 import collections as cl
 import numpy as np
+import pandas as pd
+from paprotka.archive import load_arrays, save_arrays
+from paprotka.parallel import make_executor, resolve_n_jobs, split_ranges
 
 
 class DecisionTreeNode:
@@ -35,7 +38,7 @@ class DecisionTreeNode:
 class DecisionTreeLeaf:
     def __init__(self, labels, score):
         self.counts = cl.Counter(labels)
-        self.label = self.counts.most_common(1)[0][0]
+        self.label = max(sorted(self.counts), key=self.counts.get)  # the smallest of the most common
         self.score = score
 
     def classify(self, point):
@@ -60,66 +63,329 @@ def count_uniques(values):
     return np.array([(values == unique).sum() for unique in unique_values])
 
 
-def split_best(features, labels, score_function, current_score=None, min_samples_leaf=1):
-    if current_score is None:
-        current_score = score_function(labels)
-
-    min_score = float('Inf')
-    for column in features:
-        series = features[column]
-        for division in find_dividing_points(series):
-            lesser_pos = series < division
-            divided_features = (features[lesser_pos], features[~lesser_pos])
-            divided_labels = (labels[lesser_pos], labels[~lesser_pos])
+def split_best(features, labels, score_function, current_score=None, min_samples_leaf=1,
+               max_depth=None, min_samples_split=2, max_features=None, random_state=None):
+    """Grows a tree choosing at every node the split with the lowest weighted score of both parts.
+    Every column is sorted once per node and all its splits are scored from cumulative class
+    counts, so features are only divided for the chosen split. With max_features every node
+    only considers that many randomly chosen columns."""
+    columns = features.columns if hasattr(features, 'columns') else np.arange(np.shape(features)[1])
+    unique_labels, codes = np.unique(np.ravel(labels), return_inverse=True)
+    values = np.asarray(features, dtype=np.float64)
+    random = np.random.default_rng(random_state)
+    candidate_num = count_features(max_features, values.shape[1])
+
+    def grow(values, codes, score, depth):
+        if not may_split(codes.size, depth, max_depth, min_samples_split):
+            return DecisionTreeLeaf(unique_labels[codes], score)
+
+        candidates = sample_columns(values.shape[1], candidate_num, random)
+        best = find_best_division(values, codes, unique_labels.size, score_function, min_samples_leaf, candidates)
+        if best is None or best[0] >= score:
+            return DecisionTreeLeaf(unique_labels[codes], score)
+
+        min_score, column, division, lesser_score, greater_score = best
+        lesser_pos = values[:, column] < division
+        lesser = grow(values[lesser_pos], codes[lesser_pos], lesser_score, depth + 1)
+        greater = grow(values[~lesser_pos], codes[~lesser_pos], greater_score, depth + 1)
+        return DecisionTreeNode(columns[column], division, lesser, greater, score)
 
-            divided_scores = [score_function(count_uniques(labels)) for labels in divided_labels]
+    if current_score is None:
+        current_score = score_function(np.bincount(codes, minlength=unique_labels.size))
+    return grow(values, codes, current_score, 0)
+
+
+def may_split(size, depth, max_depth=None, min_samples_split=2):
+    return size >= min_samples_split and (max_depth is None or depth < max_depth)
+
+
+def count_features(max_features, column_num):
+    """Number of columns considered by every split, all of them for None."""
+    if max_features is None:
+        count = column_num
+    elif isinstance(max_features, str):
+        if max_features not in MAX_FEATURES:
+            raise ValueError('unknown max_features {}'.format(max_features))
+        count = MAX_FEATURES[max_features](column_num)
+    elif isinstance(max_features, float):
+        count = int(max_features * column_num)
+    else:
+        count = max_features
+    return min(column_num, max(1, count))
+
+
+def sample_columns(column_num, candidate_num, random):
+    """Sorted random choice of candidate_num columns, None meaning all columns."""
+    if candidate_num >= column_num:
+        return None
+    return np.sort(random.choice(column_num, candidate_num, replace=False))
+
+
+def find_best_division(values, codes, class_num, score_function, min_samples_leaf=1, columns=None):
+    """Returns (score, column, division, lesser score, greater score) of the best split of rows
+    into values[:, column] < division and the rest, None when no split is possible.
+    Only the given columns are considered if any."""
+    size = codes.size
+    one_hot = np.eye(class_num, dtype=np.int64)
+    total_counts = np.bincount(codes, minlength=class_num)
+    lesser_sizes = np.arange(1, size)  # split after every position of a sorted column
+    allowed = (lesser_sizes >= min_samples_leaf) & (size - lesser_sizes >= min_samples_leaf)
+
+    best = None
+    for column in range(values.shape[1]) if columns is None else columns:
+        order = np.argsort(values[:, column], kind='stable')
+        ordered = values[order, column]
+        split_positions = np.flatnonzero(allowed & (ordered[:-1] < ordered[1:]))
+        if split_positions.size == 0:
+            continue
+
+        lesser_counts = np.cumsum(one_hot[codes[order]], axis=0)[split_positions]
+        lesser_scores = score_function(lesser_counts)
+        greater_scores = score_function(total_counts - lesser_counts)
+        lesser_percentages = lesser_sizes[split_positions] / size
+        scores = lesser_percentages * lesser_scores + (1 - lesser_percentages) * greater_scores
+
+        position = np.argmin(scores)
+        if best is None or scores[position] < best[0]:
+            lower, upper = ordered[split_positions[position]], ordered[split_positions[position] + 1]
+            division = (lower + upper) * 0.5
+            if not division > lower:
+                division = upper
+            best = (scores[position], column, division, lesser_scores[position], greater_scores[position])
+    return best
+
+
+def split_hist(features, labels, score_function, current_score=None, min_samples_leaf=1,
+               max_depth=None, min_samples_split=2, max_features=None, random_state=None, max_bins=256, n_jobs=1):
+    """Like split_best, but only splits between at most max_bins quantile bins of every column.
+    Bins are stored as uint8 and splits are scored from class histograms of bins of every node,
+    the histograms of the larger child are those of its parent minus the smaller child's.
+    Histograms of different columns are counted in n_jobs threads."""
+    columns = features.columns if hasattr(features, 'columns') else np.arange(np.shape(features)[1])
+    unique_labels, codes = np.unique(np.ravel(labels), return_inverse=True)
+    edges, bins = make_bins(np.asarray(features, dtype=np.float64), max_bins)
+    class_num = unique_labels.size
+    bin_num = max(len(column_edges) for column_edges in edges) + 1
+    min_samples_leaf = max(1, min_samples_leaf)
+    n_threads = resolve_n_jobs(n_jobs)
+    random = np.random.default_rng(random_state)
+    candidate_num = count_features(max_features, len(edges))
+
+    def grow(rows, histograms, score, depth):
+        if not may_split(rows.size, depth, max_depth, min_samples_split):
+            return DecisionTreeLeaf(unique_labels[codes[rows]], score)
+
+        candidates = sample_columns(len(edges), candidate_num, random)
+        considered = histograms if candidates is None else histograms[candidates]
+        lesser_counts = np.cumsum(considered, axis=1)[:, :-1]  # d x B - 1 x C, split after every bin
+        lesser_sizes = lesser_counts.sum(axis=2)
+        allowed = ((lesser_sizes >= min_samples_leaf) & (rows.size - lesser_sizes >= min_samples_leaf)
+                   & (considered[:, :-1].sum(axis=2) > 0))
+        split_columns, split_bins = np.nonzero(allowed)
+        if split_columns.size == 0:
+            return DecisionTreeLeaf(unique_labels[codes[rows]], score)
+
+        lesser_counts = lesser_counts[split_columns, split_bins]  # S x C
+        lesser_scores = score_function(lesser_counts)
+        greater_scores = score_function(histograms[0].sum(axis=0) - lesser_counts)
+        lesser_percentages = lesser_sizes[split_columns, split_bins] / rows.size
+        scores = lesser_percentages * lesser_scores + (1 - lesser_percentages) * greater_scores
+        position = np.argmin(scores)
+        if scores[position] >= score:
+            return DecisionTreeLeaf(unique_labels[codes[rows]], score)
+        column = split_columns[position] if candidates is None else candidates[split_columns[position]]
+        last_bin = split_bins[position]
+
+        lesser_pos = bins[column, rows] <= last_bin
+        lesser_rows, greater_rows = rows[lesser_pos], rows[~lesser_pos]
+        if lesser_rows.size <= greater_rows.size:
+            lesser_histograms = class_histograms(bins, codes, lesser_rows, class_num, bin_num, executor, n_threads)
+            greater_histograms = histograms - lesser_histograms
+        else:
+            greater_histograms = class_histograms(bins, codes, greater_rows, class_num, bin_num, executor, n_threads)
+            lesser_histograms = histograms - greater_histograms
+
+        lesser = grow(lesser_rows, lesser_histograms, lesser_scores[position], depth + 1)
+        greater = grow(greater_rows, greater_histograms, greater_scores[position], depth + 1)
+        return DecisionTreeNode(columns[column], edges[column][last_bin], lesser, greater, score)
+
+    with make_executor(n_threads, 'thread') as executor:
+        rows = np.arange(codes.size)
+        histograms = class_histograms(bins, codes, rows, class_num, bin_num, executor, n_threads)
+        if current_score is None:
+            current_score = score_function(histograms[0].sum(axis=0))
+        return grow(rows, histograms, current_score, 0)
+
+
+def make_bins(values, max_bins=256):
+    """Edges of at most max_bins bins of every column and d x N uint8 bins of values.
+    Columns with few distinct values are split between all of them, others at quantiles.
+    Bin b holds values v with edges[b - 1] <= v < edges[b]."""
+    if not 2 <= max_bins <= 256:
+        raise ValueError('max_bins must be between 2 and 256, got {}'.format(max_bins))
+    edges = []
+    bins = np.empty((values.shape[1], values.shape[0]), dtype=np.uint8)
+    for column in range(values.shape[1]):
+        distinct = np.unique(values[:, column])
+        if distinct.size <= max_bins:
+            middles = (distinct[1:] + distinct[:-1]) * 0.5
+            column_edges = np.where(middles > distinct[:-1], middles, distinct[1:])
+        else:
+            column_edges = np.unique(np.quantile(values[:, column], np.linspace(0, 1, max_bins + 1)[1:-1]))
+        edges.append(column_edges)
+        bins[column] = np.searchsorted(column_edges, values[:, column], side='right')
+    return edges, bins
 
-            lesser_percentage = divided_labels[0].size / labels.size
-            total_score = lesser_percentage * divided_scores[0] + (1 - lesser_percentage) * divided_scores[1]
 
-            if any(labels.size < min_samples_leaf for labels in divided_labels):
-                continue
+def class_histograms(bins, codes, rows, class_num, bin_num, executor, parts):
+    """Counts of classes of rows in every bin of every column, d x B x C. Small nodes are counted
+    with a single bincount over all columns instead of in threads."""
+    column_num = bins.shape[0]
+    row_codes = codes[rows]
+    if parts == 1 or rows.size < HIST_THREAD_MIN_ROWS:
+        offsets = np.arange(column_num)[:, None] * bin_num
+        positions = (bins[:, rows] + offsets) * class_num + row_codes
+        return np.bincount(positions.ravel(), minlength=column_num * bin_num * class_num).reshape(
+            column_num, bin_num, class_num)
 
-            if total_score < min_score:
-                min_score = total_score
-                min_column = column
-                min_division = division
-                min_scores = divided_scores
-                min_features = divided_features
-                min_labels = divided_labels
+    histograms = np.empty((column_num, bin_num, class_num), dtype=np.int64)
 
-    if min_score >= current_score:
-        return DecisionTreeLeaf(labels, current_score)
+    def count(column_range):
+        for column in range(*column_range):
+            positions = bins[column, rows].astype(np.intp) * class_num + row_codes
+            histograms[column] = np.bincount(positions, minlength=bin_num * class_num).reshape(bin_num, class_num)
 
-    nodes = [split_best(features, labels, score_function, score, min_samples_leaf)
-             for features, labels, score in zip(min_features, min_labels, min_scores)]
-    return DecisionTreeNode(min_column, min_division, nodes[0], nodes[1], current_score)
+    list(executor.map(count, split_ranges(column_num, parts)))
+    return histograms
 
 
 def find_dividing_points(values):
     ordered = np.unique(np.sort(values))
-    middles = (ordered[1:] + ordered[:1]) * 0.5
+    middles = (ordered[1:] + ordered[:-1]) * 0.5
     yield from middles
 
 
+HIST_THREAD_MIN_ROWS = 4096
+MAX_FEATURES = {'sqrt': lambda column_num: int(np.sqrt(column_num)),
+                'log2': lambda column_num: int(np.log2(column_num))}
+
+
+def gini(counts):
+    percentages = counts / counts.sum(axis=-1, keepdims=True)
+    return 1 - np.sum(percentages ** 2, axis=-1)
+
+
 def entropy(counts):
-    percentages = counts / counts.sum()
-    return -np.sum(percentages * np.log(percentages))
+    percentages = counts / counts.sum(axis=-1, keepdims=True)
+    return -np.sum(percentages * np.log(np.where(percentages > 0, percentages, 1)), axis=-1)
+
+
+def flatten_tree(tree, columns, unique_labels):
+    """Turns a tree of nodes into parallel arrays indexed by node in breadth first order:
+    feature is the column position tested by a node or -1 for leaves, left and right are positions
+    of children of nodes sending rows with features < threshold to the left, value has class counts
+    of training rows reaching every node."""
+    column_positions = {column: position for position, column in enumerate(columns)}
+    nodes = [tree]
+    left, right = [], []
+    for node in nodes:
+        if isinstance(node, DecisionTreeNode):
+            left.append(len(nodes))
+            right.append(len(nodes) + 1)
+            nodes.extend((node.lesser, node.greater))
+        else:
+            left.append(-1)
+            right.append(-1)
+
+    arrays = {
+        'feature': np.full(len(nodes), -1, dtype=np.intp),
+        'threshold': np.zeros(len(nodes), dtype=np.float64),
+        'left': np.array(left, dtype=np.intp),
+        'right': np.array(right, dtype=np.intp),
+        'value': np.zeros((len(nodes), unique_labels.size), dtype=np.int64),
+    }
+    for position in reversed(range(len(nodes))):
+        node = nodes[position]
+        if isinstance(node, DecisionTreeNode):
+            arrays['feature'][position] = column_positions[node.column]
+            arrays['threshold'][position] = node.division
+            arrays['value'][position] = arrays['value'][left[position]] + arrays['value'][right[position]]
+        else:
+            labels = list(node.counts)
+            arrays['value'][position, np.searchsorted(unique_labels, labels)] = [node.counts[label] for label in labels]
+    return arrays
 
 
 class DecisionTreeClassifier:
-    CRITERIA = {'gini': lambda counts: np.sum((counts / counts.sum()) ** 2),
+    CRITERIA = {'gini': gini,
                 'entropy': entropy}
-    SPLITTERS = {'best': split_best}
+    SPLITTERS = {'best': split_best, 'hist': split_hist}
+    NODE_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value')
 
     def __init__(self, criterion, splitter, **splitter_kwargs):
+        self.criterion_name = criterion
+        self.splitter_name = splitter
         self.criterion = self.CRITERIA[criterion]
         self.splitter = self.SPLITTERS[splitter]
         self.splitter_kwargs = splitter_kwargs
+        self.tree = None
+        self.columns = None
 
     def fit(self, features, labels):
         self.unique_labels = np.unique(labels)
+        self.columns = list(features.columns) if hasattr(features, 'columns') else None
         self.tree = self.splitter(features, labels, self.criterion, **self.splitter_kwargs)
+        columns = self.columns if self.columns is not None else range(np.shape(features)[1])
+        for name, array in flatten_tree(self.tree, columns, self.unique_labels).items():
+            setattr(self, name, array)
+
+    def _values(self, features):
+        if self.columns is not None and hasattr(features, 'columns'):
+            features = features[self.columns]
+        return np.asarray(features, dtype=np.float64)
+
+    def apply(self, features):
+        """Leaf reached by every row, rows descend together one level of the tree at a time."""
+        values = self._values(features)
+        nodes = np.zeros(values.shape[0], dtype=np.intp)
+        rows = np.flatnonzero(self.feature[nodes] >= 0)
+        while rows.size > 0:
+            current = nodes[rows]
+            lesser = values[rows, self.feature[current]] < self.threshold[current]
+            nodes[rows] = np.where(lesser, self.left[current], self.right[current])
+            rows = rows[self.feature[nodes[rows]] >= 0]
+        return nodes
 
     def predict(self, test_features):
-        return test_features.apply(self.tree.classify, axis=1)
+        labels = self.unique_labels[np.argmax(self.value[self.apply(test_features)], axis=1)]
+        if hasattr(test_features, 'index'):
+            return pd.Series(labels, index=test_features.index)
+        return labels
+
+    def to_arrays(self):
+        arrays = {name: getattr(self, name) for name in self.NODE_ARRAYS}
+        arrays['unique_labels'] = self.unique_labels
+        if self.unique_labels.dtype == object:  # e.g. strings from pandas
+            if not all(isinstance(label, str) for label in self.unique_labels):
+                raise ValueError('only labels of a numpy dtype or strings can be stored')
+            arrays['unique_labels'] = self.unique_labels.astype(str)
+        attributes = {'criterion': self.criterion_name, 'splitter': self.splitter_name,
+                      'splitter_kwargs': self.splitter_kwargs, 'columns': self.columns}
+        return arrays, attributes
+
+    @classmethod
+    def from_arrays(cls, arrays, attributes):
+        classifier = cls(attributes['criterion'], attributes['splitter'], **attributes['splitter_kwargs'])
+        classifier.columns = attributes['columns']
+        classifier.unique_labels = arrays['unique_labels']
+        for name in cls.NODE_ARRAYS:
+            setattr(classifier, name, arrays[name])
+        return classifier
+
+    def save(self, path):
+        """Stores the node arrays, the tree of node objects is not kept."""
+        save_arrays(path, *self.to_arrays())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        return cls.from_arrays(*load_arrays(path, mmap))
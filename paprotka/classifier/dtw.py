@@ -1,55 +1,337 @@
+import functools as ft
+import hashlib
 import math
+import os
 import fastdtw
 import numpy as np
-from paprotka.metric import METRICS
+from scipy import ndimage
+from paprotka.archive import load_arrays, save_arrays
+from paprotka.metric import METRICS, get_pairwise_metric, metric_name
+from paprotka.parallel import make_executor, resolve_n_jobs, split_ranges
 
 
-def calculate_dtw(metric, pattern, sequence):
-    pattern_size = len(pattern)
-    sequence_size = len(sequence)
+BAND_BLOCK_ROWS = 64
 
-    if sequence_size < pattern_size:
-        sequence_size, pattern_size = pattern_size, sequence_size
+
+def accumulate_banded_numpy(cost, lo, hi, cutoff):
+    """NumPy version of paprotka.integration.cython.dtw.accumulate_banded, cost being banded as returned
+    by banded_cost. The dependency on the left neighbour is resolved per row as D = S + cummin(A - S + c),
+    where S are cumulative sums of costs c and A are the best of the upper and diagonal neighbours,
+    so it loops only over rows."""
+    rows = cost.shape[0]
+    previous, previous_lo = np.zeros(1), -1  # the start is reached diagonally from a cell costing 0
+    for i in range(rows):
+        start, end = lo[i], hi[i]
+        costs = cost[i, :end - start]
+        # extended[t + 1] is the cell previous_lo + t of the previous row, infinite outside its range
+        extended = np.full(end - previous_lo + 1, math.inf)
+        extended[1:previous.size + 1] = previous[:end - previous_lo]
+        above = np.minimum(extended[start - previous_lo + 1:end - previous_lo + 1],
+                           extended[start - previous_lo:end - previous_lo])
+        sums = np.cumsum(costs)
+        row = sums + np.minimum.accumulate(above - sums + costs)
+        cost[i, :end - start] = row
+        if row.size == 0 or row.min() > cutoff:
+            return math.inf
+        previous, previous_lo = row, start
+    return cost[rows - 1, hi[rows - 1] - 1 - lo[rows - 1]]
+
+
+try:
+    from paprotka.integration.cython.dtw import accumulate_banded
+except ImportError:  # the extension wasn't built
+    accumulate_banded = accumulate_banded_numpy
+
+
+@ft.lru_cache(maxsize=256)
+def make_window(rows, cols, window=None, slope=None):
+    """Ranges [lo[i], hi[i]) of columns allowed in each row by a Sakoe-Chiba band of given radius
+    around the diagonal and by an Itakura parallelogram of given maximum slope. Ranges are widened
+    where needed so that a warping path from the first to the last cell always exists."""
+    lo = np.zeros(rows, dtype=np.intp)
+    hi = np.full(rows, cols, dtype=np.intp)
+    position = np.arange(rows) / max(rows - 1, 1)
+
+    if window is not None:
+        center = position * (cols - 1)
+        lo = np.maximum(lo, np.ceil(center - window).astype(np.intp))
+        hi = np.minimum(hi, np.floor(center + window).astype(np.intp) + 1)
+    if slope is not None:
+        lower = np.maximum(position / slope, 1 - slope * (1 - position)) * (cols - 1)
+        upper = np.minimum(position * slope, 1 - (1 - position) / slope) * (cols - 1)
+        lo = np.maximum(lo, np.ceil(lower - 1e-9).astype(np.intp))
+        hi = np.minimum(hi, np.floor(upper + 1e-9).astype(np.intp) + 1)
+
+    lo[0] = 0
+    hi[0] = max(hi[0], 1)
+    for i in range(1, rows):
+        lo[i] = min(max(lo[i], lo[i - 1]), hi[i - 1])
+        hi[i] = max(hi[i], lo[i] + 1)
+    hi[-1] = cols
+    lo.flags.writeable = False
+    hi.flags.writeable = False
+    return lo, hi
+
+
+def as_frames(sequence):
+    sequence = np.asarray(sequence, dtype=np.float64)
+    return sequence.reshape(len(sequence), -1)
+
+
+def banded_cost(pairwise, pattern, sequence, lo, hi):
+    """Costs of cells [lo[i], hi[i]) of every row of the sequence x pattern matrix, cell (i, j) stored
+    at [i, j - lo[i]] and infinite past hi[i] - lo[i]. Rows are computed in blocks, each only against
+    the columns the band allows in it."""
+    rows, cols = len(sequence), len(pattern)
+    if not lo.any() and (hi == cols).all():
+        return np.ascontiguousarray(pairwise(pattern, sequence).T)
+
+    width = int((hi - lo).max())
+    offsets = np.arange(width)
+    cost = np.full((rows, width), math.inf)
+    step = max(width, BAND_BLOCK_ROWS)
+    for start in range(0, rows, step):
+        end = min(start + step, rows)
+        first, last = lo[start], hi[end - 1]  # both ends of the band only move right
+        block = pairwise(pattern[first:last], sequence[start:end]).T
+        columns = np.minimum(lo[start:end, None] - first + offsets, last - first - 1)
+        inside = offsets < (hi - lo)[start:end, None]
+        cost[start:end][inside] = np.take_along_axis(block, columns, axis=1)[inside]
+    return cost
+
+
+def backtrack_path(accumulated, lo, hi):
+    """Cheapest warping path through a banded accumulated cost matrix as (row, column) pairs."""
+    def cell(step):
+        i, j = step
+        return accumulated[i, j - lo[i]] if i >= 0 and lo[i] <= j < hi[i] else math.inf
+
+    i, j = accumulated.shape[0] - 1, hi[-1] - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        i, j = min([(i - 1, j - 1), (i - 1, j), (i, j - 1)], key=cell)
+        path.append((i, j))
+    path.reverse()
+    return path
+
+
+def calculate_dtw(metric, pattern, sequence, window=None, slope=None, cutoff=math.inf, return_path=False):
+    """Exact DTW distance, metric being a name, a METRICS function or a vectorized pairwise function.
+    window limits the warping to a Sakoe-Chiba band and slope to an Itakura parallelogram. Returns
+    infinity as soon as every cell of some row costs more than cutoff. With return_path also returns
+    the warping path as a list of (pattern index, sequence index) pairs."""
+    pattern = as_frames(pattern)
+    sequence = as_frames(sequence)
+    swapped = len(sequence) < len(pattern)
+    if swapped:
         sequence, pattern = pattern, sequence
 
-    prev_row = np.full(pattern_size + 1, math.inf, dtype=np.float64)
-    prev_row[0] = 0
-    current_row = np.zeros(pattern_size + 1, dtype=np.float64)
-    current_row[0] = math.inf
+    lo, hi = make_window(len(sequence), len(pattern), window, slope)
+    cost = banded_cost(get_pairwise_metric(metric), pattern, sequence, lo, hi)  # sequence x band
+    distance = accumulate_banded(cost, lo, hi, cutoff)
+    if not return_path:
+        return distance
+
+    path = backtrack_path(cost, lo, hi) if distance < math.inf else []
+    return distance, [(i, j) if swapped else (j, i) for i, j in path]
+
+
+_worker_state = {}
+
+
+def _init_worker(state):
+    _worker_state.update(state)
+
+
+def _dtw_rows(start, end, state=None):
+    """Rows of a DTW matrix for the given state or workers initialized with _init_worker,
+    only right of the diagonal in the symmetric mode."""
+    state = _worker_state if state is None else state
+    first, second = state['first'], state['second']
+    symmetric = second is None
+    if symmetric:
+        second = first
+    rows = np.zeros((end - start, len(second)), dtype=np.float64)
+    for i in range(start, end):
+        for j in range(i + 1 if symmetric else 0, len(second)):
+            rows[i - start, j] = calculate_dtw(state['metric'], first[i], second[j], state['window'], state['slope'])
+    return rows
 
-    for i, sequence_window in enumerate(sequence):
-        for j, pattern_window in enumerate(pattern):
-            distance = metric(pattern_window, sequence_window)
-            prev_distance = min(prev_row[j], prev_row[j + 1], current_row[j])
-            current_row[j + 1] = prev_distance + distance
-        prev_row[:] = current_row
-        current_row[0] = math.inf
 
-    return prev_row[-1]
+def sequences_digest(sequences):
+    """Hex digest of dtypes, shapes and contents of all sequences."""
+    digest = hashlib.sha256()
+    for sequence in sequences:
+        sequence = np.ascontiguousarray(sequence)
+        digest.update('{}{}'.format(sequence.dtype.str, sequence.shape).encode())
+        digest.update(sequence.tobytes())
+    return digest.hexdigest()
+
+
+def calculate_dtw_matrix(metric, first, second=None, window=None, slope=None, n_jobs=1, backend='process',
+                         cache=None):
+    """DTW distances between all sequences of first and second, computed by a pool of n_jobs workers.
+    Without second computes the symmetric matrix of first, evaluating each pair once. If cache is
+    a path, a matrix stored there for the same arguments and the same sequences (compared by digests
+    of their contents) is loaded instead and new results are saved."""
+    name = metric_name(metric)
+    attributes = {'metric': name, 'window': window, 'slope': slope, 'symmetric': second is None,
+                  'shape': [len(first), len(first if second is None else second)],
+                  'first': sequences_digest(first), 'second': None if second is None else sequences_digest(second)}
+    if cache is not None and os.path.exists(cache):
+        arrays, stored_attributes = load_arrays(cache, mmap=False)
+        if stored_attributes == attributes:
+            return arrays['distances']
+
+    row_num, col_num = attributes['shape']
+    state = {'metric': name or metric, 'first': first, 'second': second, 'window': window, 'slope': slope}
+    if resolve_n_jobs(n_jobs) == 1:
+        distances = _dtw_rows(0, row_num, state)
+    else:
+        # the symmetric rows get shorter, so there are more parts than workers to balance the load
+        ranges = split_ranges(row_num, resolve_n_jobs(n_jobs) * 4)
+        with make_executor(n_jobs, backend, _init_worker, (state,)) as executor:
+            futures = [executor.submit(_dtw_rows, start, end) for start, end in ranges]
+            distances = np.concatenate([future.result() for future in futures] + [np.zeros((0, col_num))])
+    if second is None:
+        distances += distances.T
+
+    if cache is not None:
+        save_arrays(cache, {'distances': distances}, attributes)
+    return distances
+
+
+def _nearest_patterns(sequences):
+    classifier = _worker_state['classifier']
+    return [classifier.nearest(sequence)[0] for sequence in sequences]
+
+
+ENVELOPE_BOUNDS = {
+    'euclidean': lambda gaps: np.square(gaps).sum(),
+    'manhattan': lambda gaps: gaps.sum(),
+    'chebyshev': lambda gaps: gaps.max(axis=1).sum()
+}
+
+
+def make_envelope(pattern, radius=None):
+    """Lower and upper envelopes of frames within radius of each frame or of the whole pattern."""
+    if radius is None:
+        return pattern.min(axis=0, keepdims=True), pattern.max(axis=0, keepdims=True)
+    size = 2 * radius + 1
+    return (ndimage.minimum_filter1d(pattern, size, axis=0, mode='nearest'),
+            ndimage.maximum_filter1d(pattern, size, axis=0, mode='nearest'))
+
+
+def lb_kim(metric, first_frames, last_frames, single_frames, sequence):
+    """Costs of the first and last cells, which every warping path contains, for all patterns at once."""
+    pairwise = get_pairwise_metric(metric)
+    bounds = pairwise(sequence[:1], first_frames)[0]
+    last = pairwise(sequence[-1:], last_frames)[0]
+    if len(sequence) == 1:
+        last[single_frames] = 0
+    return bounds + last
+
+
+def lb_keogh(name, lower, upper, sequence):
+    """Every frame of sequence is matched to some frame within the envelope, so its distance to the
+    envelope bounds the cost of that frame. Lower and upper have a row per frame or a single row."""
+    gaps = np.maximum(lower - sequence, 0) + np.maximum(sequence - upper, 0)
+    return ENVELOPE_BOUNDS[name](gaps)
 
 
 class DynamicTimeWarpingClassifier:
-    def __init__(self, metric='euclidean'):
+    """With the exact method, metrics in ENVELOPE_BOUNDS use a pruning cascade: patterns are visited
+    in the order of LB_Kim, skipped when LB_Kim or LB_Keogh can't beat the best distance so far and
+    the DTW itself is abandoned as soon as it exceeds it. The result is the same as of a full search.
+    With n_jobs the query sequences are split between a pool of workers, each with a copy of the model."""
+    METHODS = ('exact', 'fastdtw')
+
+    def __init__(self, metric='euclidean', method='exact', window=None, slope=None, n_jobs=1, backend='process'):
+        if method not in self.METHODS:
+            raise ValueError('unknown method {}'.format(method))
         self.metric = METRICS[metric]
+        self.method = method
+        self.window = window
+        self.slope = slope
+        self.n_jobs = n_jobs
+        self.backend = backend
         self.patterns = None
         self.labels = None
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['metric'] = metric_name(self.metric)  # METRICS functions are lambdas, which don't pickle
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.metric = METRICS[state['metric']]
+
     def fit(self, features, labels):
         self.patterns = features
         self.labels = labels
+        self.prunable = self.method == 'exact' and metric_name(self.metric) in ENVELOPE_BOUNDS
+        if not self.prunable:
+            return
+
+        frames = [as_frames(pattern) for pattern in features]
+        self.first_frames = np.array([pattern[0] for pattern in frames])
+        self.last_frames = np.array([pattern[-1] for pattern in frames])
+        self.single_frames = np.array([len(pattern) == 1 for pattern in frames])
+        self.envelopes = [make_envelope(pattern) for pattern in frames]
+        self.band_envelopes = None
+        if self.window is not None:
+            radius = int(math.ceil(self.window)) + 2  # covers the band with the widening of make_window
+            self.band_envelopes = [make_envelope(pattern, radius) for pattern in frames]
+
+    def distance(self, pattern, sequence, cutoff=math.inf):
+        if self.method == 'fastdtw':
+            distance, _ = fastdtw.fastdtw(pattern, sequence, dist=self.metric)
+            return distance
+        return calculate_dtw(self.metric, pattern, sequence, self.window, self.slope, cutoff)
+
+    def keogh_bound(self, j, sequence):
+        lower, upper = self.envelopes[j]
+        pattern_size = len(self.patterns[j])
+        if self.band_envelopes is not None and len(sequence) >= pattern_size:
+            # frame i is matched within the band around the frame at the scaled diagonal
+            centers = np.rint(np.arange(len(sequence)) * ((pattern_size - 1) / max(len(sequence) - 1, 1)))
+            lower, upper = (envelope[centers.astype(np.intp)] for envelope in self.band_envelopes[j])
+        return lb_keogh(metric_name(self.metric), lower, upper, sequence)
+
+    def nearest(self, sequence):
+        """Position of the closest pattern and its distance, the first one wins ties."""
+        if not self.prunable:
+            distances = [self.distance(pattern, sequence) for pattern in self.patterns]
+            j = int(np.argmin(distances))
+            return j, distances[j]
+
+        sequence = as_frames(sequence)
+        kim_bounds = lb_kim(self.metric, self.first_frames, self.last_frames, self.single_frames, sequence)
+        min_distance, min_j = math.inf, -1
+        for j in np.argsort(kim_bounds, kind='stable'):
+            if kim_bounds[j] > min_distance:
+                break
+            if self.keogh_bound(j, sequence) > min_distance:
+                continue
+            distance = self.distance(self.patterns[j], sequence, min_distance)
+            if distance < min_distance or (distance == min_distance and j < min_j):
+                min_distance, min_j = distance, j
+        return min_j, min_distance
 
     def predict(self, features):
         sequence_num = len(features)
 
+        if resolve_n_jobs(self.n_jobs) == 1:
+            nearest = [self.nearest(sequence)[0] for sequence in features]
+        else:
+            ranges = split_ranges(sequence_num, resolve_n_jobs(self.n_jobs) * 4)
+            with make_executor(self.n_jobs, self.backend, _init_worker, ({'classifier': self},)) as executor:
+                futures = [executor.submit(_nearest_patterns, features[start:end]) for start, end in ranges]
+                nearest = [j for future in futures for j in future.result()]
+
         results = np.zeros(sequence_num, dtype=self.labels.dtype)
-        for i, sequence in enumerate(features):
-            min_distance = None
-            min_label = None
-            for j, pattern in enumerate(self.patterns):
-                distance, _ = fastdtw.fastdtw(pattern, sequence, dist=self.metric)
-                if min_distance is None or distance < min_distance:
-                    min_distance = distance
-                    min_label = self.labels[j]
-            results[i] = min_label
+        for i, j in enumerate(nearest):
+            results[i] = self.labels[j]
 
         return results
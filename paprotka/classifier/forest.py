@@ -0,0 +1,86 @@
+import contextlib
+import numpy as np
+import pandas as pd
+from paprotka.classifier.decision_tree import DecisionTreeClassifier
+from paprotka.classifier.neighbor import majority_vote
+from paprotka.parallel import load_shared, make_executor, resolve_n_jobs, shared_arrays
+
+
+def fit_tree(data, seed, class_num, criterion, splitter, bootstrap, splitter_kwargs):
+    """Node arrays of a tree fitted on a bootstrap sample of rows, with class counts of all class_num codes.
+    data holds values and codes arrays, or is the path of an archive from shared_arrays."""
+    if isinstance(data, str):
+        data = load_shared(data)[0]
+    values, codes = data['values'], data['codes']
+    random = np.random.default_rng(seed)
+    rows = random.integers(0, codes.size, codes.size) if bootstrap else np.arange(codes.size)
+
+    tree = DecisionTreeClassifier(criterion, splitter, random_state=random, **splitter_kwargs)
+    tree.fit(values[rows], codes[rows])
+    arrays = {name: getattr(tree, name) for name in DecisionTreeClassifier.NODE_ARRAYS}
+    arrays['value'] = np.zeros((tree.value.shape[0], class_num), dtype=np.int64)
+    arrays['value'][:, tree.unique_labels] = tree.value
+    return arrays
+
+
+class RandomForestClassifier:
+    """Decision trees fitted on bootstrap samples of rows, each split considering max_features random columns,
+    predicting the label most trees vote for. Trees are fitted by a pool of n_jobs workers, with the process
+    backend they read the training data from a shared memory map instead of getting a pickled copy per tree.
+    Votes are counted for chunk_size rows at a time."""
+
+    def __init__(self, n_estimators=10, criterion='gini', splitter='best', max_features='sqrt', bootstrap=True,
+                 random_state=None, n_jobs=1, backend='process', chunk_size=4096, **splitter_kwargs):
+        self.n_estimators = n_estimators
+        self.criterion = criterion
+        self.splitter = splitter
+        self.max_features = max_features
+        self.bootstrap = bootstrap
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.splitter_kwargs = splitter_kwargs
+        self.trees = None
+        self.columns = None
+
+    def fit(self, features, labels):
+        self.columns = list(features.columns) if hasattr(features, 'columns') else None
+        data = {'values': np.asarray(features, dtype=np.float64)}
+        self.unique_labels, data['codes'] = np.unique(np.ravel(labels), return_inverse=True)
+
+        seeds = np.random.SeedSequence(self.random_state).spawn(self.n_estimators)
+        args = (self.unique_labels.size, self.criterion, self.splitter, self.bootstrap,
+                dict(self.splitter_kwargs, max_features=self.max_features))
+        if resolve_n_jobs(self.n_jobs) == 1:
+            tree_arrays = [fit_tree(data, seed, *args) for seed in seeds]
+        else:
+            with contextlib.ExitStack() as stack:
+                executor = stack.enter_context(make_executor(self.n_jobs, self.backend))
+                source = data
+                if self.backend == 'process':
+                    source = stack.enter_context(shared_arrays(data))
+                futures = [executor.submit(fit_tree, source, seed, *args) for seed in seeds]
+                tree_arrays = [future.result() for future in futures]
+
+        attributes = {'criterion': self.criterion, 'splitter': self.splitter, 'splitter_kwargs': {}, 'columns': None}
+        codes = np.arange(self.unique_labels.size)
+        self.trees = [DecisionTreeClassifier.from_arrays(dict(arrays, unique_labels=codes), attributes)
+                      for arrays in tree_arrays]
+
+    def predict(self, features):
+        values = features
+        if self.columns is not None and hasattr(features, 'columns'):
+            values = features[self.columns]
+        values = np.asarray(values, dtype=np.float64)
+
+        decisions = np.empty(values.shape[0], dtype=np.intp)
+        for start in range(0, values.shape[0], self.chunk_size):
+            chunk = values[start:start + self.chunk_size]
+            votes = np.stack([np.argmax(tree.value[tree.apply(chunk)], axis=1) for tree in self.trees], axis=1)
+            decisions[start:start + self.chunk_size] = majority_vote(votes, self.unique_labels.size)
+
+        labels = self.unique_labels[decisions]
+        if hasattr(features, 'index'):
+            return pd.Series(labels, index=features.index)
+        return labels
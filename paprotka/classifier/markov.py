@@ -1,5 +1,6 @@
 import numpy as np
 from hmmlearn import hmm
+from paprotka.parallel import make_executor, resolve_n_jobs
 
 
 def states_probability(a, states, initial=1.0):
@@ -19,15 +20,173 @@ def forward_algorithm(a, b, observations, initial_probs=None):
     return current_probs.sum()
 
 
+def safe_log(values):
+    with np.errstate(divide='ignore'):
+        return np.log(values)
+
+
+def pad_sequences(sequences, fill=0):
+    """Stacks ragged sequences into a (sequences x time) array padded with fill, returns it with lengths."""
+    if isinstance(sequences, np.ndarray) and sequences.ndim == 2:
+        return sequences, np.full(sequences.shape[0], sequences.shape[1], dtype=np.intp)
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.intp)
+    padded = np.full((len(sequences), lengths.max(initial=0)), fill, dtype=np.asarray(sequences[0]).dtype)
+    for i, sequence in enumerate(sequences):
+        padded[i, :lengths[i]] = sequence
+    return padded, lengths
+
+
+def log_emissions(log_b, padded):
+    """Log probabilities of padded discrete observations in every state, sequences x time x states."""
+    return log_b.T[padded]
+
+
+def _log_matmul(log_x, matrix):
+    """log(exp(log_x) @ matrix) for rows of log_x, shifted by the row maxima to avoid underflow."""
+    shift = log_x.max(axis=1, keepdims=True)
+    shift[~np.isfinite(shift)] = 0
+    return safe_log(np.exp(log_x - shift) @ matrix) + shift
+
+
+def _log_sum(log_x):
+    shift = log_x.max(axis=1)
+    finite_shift = np.where(np.isfinite(shift), shift, 0)
+    return safe_log(np.exp(log_x - finite_shift[:, None]).sum(axis=1)) + finite_shift
+
+
+def log_forward(a, log_emission, lengths, initial_probs=None):
+    """Log-space forward pass over a batch, a[i, j] being the probability of going from i to j and
+    log_emission coming from log_emissions or any other model. Returns log forward variables,
+    -inf past the end of each sequence, and log likelihoods of the sequences."""
+    sequence_num, time_num, state_n = log_emission.shape
+    log_initial = safe_log(np.full(state_n, 1.0 / state_n) if initial_probs is None else initial_probs)
+
+    alpha = np.full(log_emission.shape, -np.inf)
+    alpha[:, 0] = log_initial + log_emission[:, 0]
+    for t in range(1, time_num):
+        active = t < lengths
+        alpha[active, t] = _log_matmul(alpha[active, t - 1], a) + log_emission[active, t]
+
+    last = alpha[np.arange(sequence_num), lengths - 1]
+    return alpha, _log_sum(last)
+
+
+def log_backward(a, log_emission, lengths):
+    """Log-space backward pass over a batch, 0 at and past the end of each sequence."""
+    sequence_num, time_num, state_n = log_emission.shape
+    beta = np.zeros(log_emission.shape)
+    for t in range(time_num - 2, -1, -1):
+        active = t < lengths - 1
+        beta[active, t] = _log_matmul(log_emission[active, t + 1] + beta[active, t + 1], a.T)
+    return beta
+
+
+def log_viterbi(a, log_emission, lengths, initial_probs=None):
+    """Most probable state paths of a batch, padded with -1, with their log probabilities."""
+    sequence_num, time_num, state_n = log_emission.shape
+    log_a = safe_log(a)
+    log_initial = safe_log(np.full(state_n, 1.0 / state_n) if initial_probs is None else initial_probs)
+
+    scores = log_initial + log_emission[:, 0]
+    backpointers = np.zeros((sequence_num, time_num, state_n), dtype=np.intp)
+    for t in range(1, time_num):
+        active = t < lengths
+        candidates = scores[active, :, None] + log_a  # sequences x from x to
+        backpointers[active, t] = np.argmax(candidates, axis=1)
+        scores[active] = np.max(candidates, axis=1) + log_emission[active, t]
+
+    paths = np.full((sequence_num, time_num), -1, dtype=np.intp)
+    rows = np.arange(sequence_num)
+    states = np.argmax(scores, axis=1)
+    for t in range(time_num - 1, -1, -1):
+        ending = t < lengths
+        paths[ending, t] = states[ending]
+        states = np.where(ending, backpointers[rows, t, states], states)
+    return paths, scores.max(axis=1)
+
+
+class DiscreteHMM:
+    """Discrete HMM scoring batches of ragged or padded observation sequences in log space.
+    a[i, j] is the probability of going from state i to j and b[i, k] of emitting k in state i."""
+
+    def __init__(self, a, b, initial_probs=None):
+        self.a = np.asarray(a, dtype=np.float64)
+        self.log_b = safe_log(np.asarray(b, dtype=np.float64))
+        self.initial_probs = initial_probs
+
+    def score(self, sequences):
+        padded, lengths = pad_sequences(sequences)
+        _, log_likelihoods = log_forward(self.a, log_emissions(self.log_b, padded), lengths, self.initial_probs)
+        return log_likelihoods
+
+    def posteriors(self, sequences):
+        """Log probabilities of states at every step given whole sequences."""
+        padded, lengths = pad_sequences(sequences)
+        log_emission = log_emissions(self.log_b, padded)
+        alpha, log_likelihoods = log_forward(self.a, log_emission, lengths, self.initial_probs)
+        return alpha + log_backward(self.a, log_emission, lengths) - log_likelihoods[:, None, None]
+
+    def decode(self, sequences):
+        padded, lengths = pad_sequences(sequences)
+        return log_viterbi(self.a, log_emissions(self.log_b, padded), lengths, self.initial_probs)
+
+
+def _train_model(concat, lengths, args, kwargs):
+    model = hmm.GMMHMM(*args, **kwargs)
+    model.fit(concat, lengths)
+    return model
+
+
+def score_sequences(models, sequences):
+    """Log likelihoods of sequences (rows) under every model (columns). Frame likelihoods of the whole
+    batch are evaluated by each model in one call and then summed by the batched forward pass.
+    That call is hmmlearn's private _compute_log_likelihood, models lacking it are scored with
+    their public score one sequence at a time."""
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.intp)
+    concat = np.vstack(sequences)
+    time_num = lengths.max(initial=0)
+    positions = np.arange(time_num) < lengths[:, None]  # where frames of concat go in padded arrays
+
+    scores = np.empty((len(sequences), len(models)))
+    for j, model in enumerate(models):
+        compute_log_likelihood = getattr(model, '_compute_log_likelihood', None)
+        if compute_log_likelihood is None:
+            scores[:, j] = [model.score(sequence) for sequence in sequences]
+            continue
+        frame_likelihoods = compute_log_likelihood(concat)
+        log_emission = np.zeros((len(sequences), time_num, frame_likelihoods.shape[1]))
+        log_emission[positions] = frame_likelihoods
+        _, scores[:, j] = log_forward(model.transmat_, log_emission, lengths, model.startprob_)
+    return scores
+
+
+_worker_models = []
+
+
+def _init_worker(models):
+    _worker_models[:] = models
+
+
+def _score_chunk(sequences):
+    return score_sequences(_worker_models, sequences)
+
+
 class HMMGMMClassifier:
-    def __init__(self):
+    """Trains one GMM-HMM per label and picks the label whose model scores a sequence best.
+    With n_jobs the models are trained in parallel, one per task, and sequences are scored
+    in chunks of chunk_size by workers holding all the models."""
+
+    def __init__(self, n_jobs=1, backend='process', chunk_size=64):
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.chunk_size = chunk_size
         self.models = None
         self.unique_labels = None
 
     def fit(self, features, labels, *args, **kwargs):
         self.unique_labels = np.unique(labels)
-        self.models = []
 
+        tasks = []
         for unique_label in self.unique_labels:
             relevant_ixs = (labels == unique_label).nonzero()[0]
             relevant_data = []
@@ -38,22 +197,28 @@ class HMMGMMClassifier:
 
             lengths = np.array([len(data) for data in relevant_data])
             concat = np.vstack(relevant_data)
-
-            model = hmm.GMMHMM(*args, **kwargs)
-            model.fit(concat, lengths)
-            self.models.append(model)
-
-    def predict(self, features):
-        results = np.zeros_like(features, dtype=self.unique_labels.dtype)
-
-        for i, sequence in enumerate(features):
-            max_probability = None
-            max_label = None
-            for j, model in enumerate(self.models):
-                probability = model.score(sequence)
-                if max_probability is None or probability > max_probability:
-                    max_probability = probability
-                    max_label = self.unique_labels[j]
-            results[i] = max_label
-
+            tasks.append((concat, lengths))
+
+        if resolve_n_jobs(self.n_jobs) == 1:
+            self.models = [_train_model(concat, lengths, args, kwargs) for concat, lengths in tasks]
+        else:
+            with make_executor(self.n_jobs, self.backend) as executor:
+                futures = [executor.submit(_train_model, concat, lengths, args, kwargs) for concat, lengths in tasks]
+                self.models = [future.result() for future in futures]
+
+    def score_matrix(self, features):
+        """Log likelihoods of every sequence (rows) under the model of every label (columns)."""
+        chunks = [features[start:start + self.chunk_size] for start in range(0, len(features), self.chunk_size)]
+        if resolve_n_jobs(self.n_jobs) == 1:
+            parts = [score_sequences(self.models, chunk) for chunk in chunks]
+        else:
+            with make_executor(self.n_jobs, self.backend, _init_worker, (self.models,)) as executor:
+                parts = list(executor.map(_score_chunk, chunks))
+        return np.concatenate(parts + [np.zeros((0, len(self.models)))])
+
+    def predict(self, features, return_scores=False):
+        scores = self.score_matrix(features)
+        results = self.unique_labels[np.argmax(scores, axis=1)]
+        if return_scores:
+            return results, scores
         return results
@@ -1,36 +1,86 @@
 import numpy as np
+from scipy import sparse, special
 
 
 class GaussianNB:
+    """Gaussian naive Bayes computing log likelihoods of all classes at once. partial_fit merges
+    running means and variances of chunks, so the model can be trained over streamed data.
+    With dtype=np.float32 the parameters and the computations use half the memory."""
     classes = None
     priors = None
     means = None
     variances = None
 
-    def __init__(self):
-        pass
+    def __init__(self, dtype=np.float64, var_smoothing=1e-9):
+        self.dtype = dtype
+        self.var_smoothing = var_smoothing
+        self.counts = None
+        self.priors_equal = True
 
     def fit(self, features, labels, priors_equal=True):
-        self.classes = np.unique(labels)
+        self.classes = None
+        self.partial_fit(features, labels, priors_equal)
 
-        self.priors = np.ones(self.classes.shape) / self.classes.size
+    def partial_fit(self, features, labels, priors_equal=True):
+        features = np.asarray(features, dtype=self.dtype)
+        chunk_classes, codes = np.unique(np.ravel(labels), return_inverse=True)
+        dims = features.shape[1]
+        if self.classes is None:
+            self.classes = chunk_classes
+            self.counts = np.zeros(chunk_classes.size, dtype=np.int64)
+            self.means = np.zeros((chunk_classes.size, dims), dtype=self.dtype)
+            self.variances = np.zeros((chunk_classes.size, dims), dtype=self.dtype)
+        elif not np.isin(chunk_classes, self.classes).all():
+            classes = np.union1d(self.classes, chunk_classes)
+            positions = np.searchsorted(classes, self.classes)
+            counts = np.zeros(classes.size, dtype=np.int64)
+            means = np.zeros((classes.size, dims), dtype=self.dtype)
+            variances = np.zeros((classes.size, dims), dtype=self.dtype)
+            counts[positions], means[positions], variances[positions] = self.counts, self.means, self.variances
+            self.classes, self.counts, self.means, self.variances = classes, counts, means, variances
 
-        self.means = {}
-        self.variances = {}
-        for i, clazz in enumerate(self.classes):
-            positions = (labels == clazz).ravel()
-            if not priors_equal:
-                self.priors[i] = positions.sum() / labels.size
-            self.means[clazz] = features[positions, :].mean(axis=0)
-            self.variances[clazz] = features[positions, :].var(axis=0)
+        one_hot = sparse.csr_matrix((np.ones(codes.size, dtype=self.dtype), (codes, np.arange(codes.size))),
+                                    shape=(chunk_classes.size, codes.size))
+        counts = np.bincount(codes, minlength=chunk_classes.size)
+        means = (one_hot @ features) / counts[:, None]
+        variances = (one_hot @ np.square(features - means[codes])) / counts[:, None]
+        self._merge(np.searchsorted(self.classes, chunk_classes), counts, means, variances)
+
+        self.priors_equal = priors_equal
+        if priors_equal:
+            self.priors = np.ones(self.classes.shape) / self.classes.size
+        else:
+            self.priors = self.counts / self.counts.sum()
+
+    def _merge(self, positions, counts, means, variances):
+        """Combines per class statistics of a chunk with the running ones (Chan et al.)."""
+        previous_counts = self.counts[positions][:, None]
+        counts = counts[:, None]
+        totals = previous_counts + counts
+        deltas = means - self.means[positions]
+        square_sums = (self.variances[positions] * previous_counts + variances * counts
+                       + np.square(deltas) * (previous_counts * counts / totals))
+        self.means[positions] += deltas * (counts / totals)
+        self.variances[positions] = square_sums / totals
+        self.counts[positions] = totals[:, 0]
+
+    def joint_log_likelihood(self, features):
+        features = np.asarray(features, dtype=self.dtype)
+        variances = self.variances + self.var_smoothing * self.variances.max()
+        precisions = 1 / variances  # classes x dims
+        # the square is expanded around the mean of all training rows, which keeps features with
+        # large offsets from cancelling badly in the products
+        reference = (self.counts @ self.means / self.counts.sum()).astype(self.dtype)
+        features, means = features - reference, self.means - reference
+        squares = (np.square(features) @ precisions.T - 2 * features @ (means * precisions).T
+                   + np.sum(np.square(means) * precisions, axis=1))  # rows x classes
+        normalization = np.sum(np.log(2 * np.pi * variances), axis=1)
+        return -0.5 * (squares + normalization) + np.log(self.priors).astype(self.dtype)
+
+    def predict_log_proba(self, features):
+        likelihoods = self.joint_log_likelihood(features)
+        return likelihoods - special.logsumexp(likelihoods, axis=1, keepdims=True)
 
     def predict(self, features):
-        likelihoods = np.zeros((features.shape[0], self.classes.size))
-        for i, clazz in enumerate(self.classes):
-            gaussians = np.exp(-np.square(features - self.means[clazz]) / (2 * self.variances[clazz])) \
-                        / np.sqrt(2 * np.pi * self.variances[clazz])
-            likelihoods[:, i] = np.product(gaussians, axis=1)
-
-        posteriors = likelihoods * self.priors
-        decisions = np.argmax(posteriors, axis=1)
-        return self.classes[decisions]
\ No newline at end of file
+        decisions = np.argmax(self.joint_log_likelihood(features), axis=1)
+        return self.classes[decisions]
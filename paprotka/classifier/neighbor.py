@@ -1,6 +1,7 @@
-import collections as cl
 import numpy as np
-from paprotka.metric import METRICS, calculate_distances
+from scipy import sparse
+from paprotka.archive import load_arrays, save_arrays
+from paprotka.metric import METRICS, iterate_pairwise_distances, metric_name, pairwise_distances
 from paprotka.struct.balltree import BallTree
 
 
@@ -9,43 +10,137 @@ class NearestCentroid:
         self.metric = METRICS[metric]
         self.patterns = None
         self.unique_labels = None
+        self.sums = None
+        self.counts = None
 
     def fit(self, features, labels):
-        self.unique_labels = np.unique(labels)
-        self.patterns = np.array([
-            features[labels.ravel() == label].mean(axis=0)
-            for label in self.unique_labels
-        ])
+        self.unique_labels = None
+        self.partial_fit(features, labels)
+
+    def partial_fit(self, features, labels):
+        """Adds a chunk of data to per class running sums and counts, so centroids can be built
+        from data that doesn't fit in memory at once. Labels unseen so far create new classes."""
+        chunk_labels, codes = np.unique(labels.ravel(), return_inverse=True)
+        if self.unique_labels is None:
+            self.unique_labels = chunk_labels
+            self.sums = np.zeros((chunk_labels.size, features.shape[1]), dtype=np.float64)
+            self.counts = np.zeros(chunk_labels.size, dtype=np.int64)
+        elif not np.isin(chunk_labels, self.unique_labels).all():
+            merged_labels = np.union1d(self.unique_labels, chunk_labels)
+            positions = np.searchsorted(merged_labels, self.unique_labels)
+            sums = np.zeros((merged_labels.size, features.shape[1]), dtype=np.float64)
+            counts = np.zeros(merged_labels.size, dtype=np.int64)
+            sums[positions] = self.sums
+            counts[positions] = self.counts
+            self.unique_labels, self.sums, self.counts = merged_labels, sums, counts
+
+        positions = np.searchsorted(self.unique_labels, chunk_labels)[codes]
+        one_hot = sparse.csr_matrix((np.ones(positions.size), (positions, np.arange(positions.size))),
+                                    shape=(self.unique_labels.size, positions.size))
+        self.sums += one_hot @ np.asarray(features, dtype=np.float64)
+        self.counts += np.bincount(positions, minlength=self.unique_labels.size)
+        self.patterns = self.sums / np.maximum(self.counts, 1)[:, None]
 
     def predict(self, features):
         rows, _ = features.shape
         result = np.empty(rows, dtype=self.unique_labels.dtype)
-        for i in range(rows):
-            distances = calculate_distances(self.metric, self.patterns, features[i])
-            label = self.unique_labels[np.argmin(distances)]
-            result[i] = label
+        for start, distances in iterate_pairwise_distances(self.metric, features, self.patterns):
+            result[start:start + distances.shape[0]] = self.unique_labels[np.argmin(distances, axis=1)]
         return result
 
 
+def brute_k_nearest(metric, features, patterns, k):
+    """Positions of k nearest patterns for every row of features, in no particular order."""
+    distances = pairwise_distances(metric, features, patterns)
+    if k >= distances.shape[1]:
+        return np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+
+def majority_vote(codes, class_num):
+    """Most common code in every row, the smallest one wins ties."""
+    rows, k = codes.shape
+    flat = (np.arange(rows)[:, None] * class_num + codes).ravel()
+    counts = np.bincount(flat, minlength=rows * class_num).reshape(rows, class_num)
+    return np.argmax(counts, axis=1)
+
+
 class KNeighborsClassifier:
-    def __init__(self, n_neighbors=5, metric='euclidean'):
+    ALGORITHMS = ('auto', 'brute', 'ball_tree')
+    AUTO_MAX_TREE_DIMS = 15
+    AUTO_MIN_TREE_ROWS = 2000
+
+    def __init__(self, n_neighbors=5, metric='euclidean', algorithm='auto', chunk_size=1024, leaf_size=20):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError('unknown algorithm {}'.format(algorithm))
         self.n_neighbors = n_neighbors
         self.metric = METRICS[metric]
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+        self.leaf_size = leaf_size
         self.tree = None
+        self.patterns = None
+        self.unique_labels = None
+        self.label_codes = None
         self.labels_dtype = str
 
+    def choose_algorithm(self, rows, dims):
+        """Trees stop pruning in high dimensions, while for few patterns or many neighbours
+        chunked brute force is cheaper than walking the tree."""
+        if self.algorithm != 'auto':
+            return self.algorithm
+        if dims > self.AUTO_MAX_TREE_DIMS or rows < self.AUTO_MIN_TREE_ROWS or self.n_neighbors * 10 > rows:
+            return 'brute'
+        return 'ball_tree'
+
     def fit(self, features, labels):
         rows, dims = features.shape
-        self.tree = BallTree(features, labels)
+        self.unique_labels, self.label_codes = np.unique(labels.ravel(), return_inverse=True)
         self.labels_dtype = labels.dtype
+        if self.choose_algorithm(rows, dims) == 'ball_tree':
+            self.tree = BallTree(features, leaf_size=self.leaf_size, metric=self.metric)
+            self.patterns = None
+        else:
+            self.tree = None
+            self.patterns = np.asarray(features, dtype=np.float64)
+
+    def kneighbors(self, features):
+        """Positions of the nearest training rows for a chunk of features, in no particular order."""
+        if self.tree is not None:
+            return self.tree.query(features, self.n_neighbors, return_distance=False)
+        return brute_k_nearest(self.metric, features, self.patterns, self.n_neighbors)
 
     def predict(self, features):
         rows, dims = features.shape
         result = np.empty(rows, dtype=self.labels_dtype)
-        for i in range(rows):
-            closest_labels = self.tree.find_k_nearest(self.n_neighbors, features[i])
-            closest_counter = cl.Counter(label[0] for label in closest_labels)
-            most_common = closest_counter.most_common()
-            max_count = most_common[0][1]
-            result[i] = min(label for label, count in most_common if count == max_count)
+        for start in range(0, rows, self.chunk_size):
+            closest = self.label_codes[self.kneighbors(features[start:start + self.chunk_size])]
+            result[start:start + self.chunk_size] = self.unique_labels[majority_vote(closest, self.unique_labels.size)]
         return result
+
+    def save(self, path):
+        arrays = {'unique_labels': self.unique_labels, 'label_codes': self.label_codes}
+        attributes = {'n_neighbors': self.n_neighbors, 'classifier_metric': metric_name(self.metric),
+                      'algorithm': self.algorithm, 'chunk_size': self.chunk_size, 'leaf_size': self.leaf_size,
+                      'labels_dtype': np.dtype(self.labels_dtype).str}
+        if self.tree is not None:
+            tree_arrays, tree_attributes = self.tree.to_arrays()
+            arrays.update(tree_arrays)
+            attributes['tree'] = tree_attributes
+        else:
+            arrays['patterns'] = self.patterns
+        save_arrays(path, arrays, attributes)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        arrays, attributes = load_arrays(path, mmap)
+        classifier = cls(attributes['n_neighbors'], attributes['classifier_metric'], attributes['algorithm'],
+                         attributes['chunk_size'], attributes['leaf_size'])
+        classifier.unique_labels = arrays['unique_labels']
+        classifier.label_codes = arrays['label_codes']
+        classifier.labels_dtype = np.dtype(attributes['labels_dtype'])
+        if 'tree' in attributes:
+            classifier.tree = BallTree.from_arrays(arrays, attributes['tree'])
+        else:
+            classifier.patterns = arrays['patterns']
+        return classifier
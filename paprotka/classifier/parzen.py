@@ -1,10 +1,24 @@
 import numpy as np
+from scipy import sparse
+from paprotka.metric import DEFAULT_BLOCK_BYTES, block_rows
+from paprotka.struct.balltree import BallTree
 
 
 class Parzen:
-    def __init__(self):
+    """Parzen window classifier on normalized vectors. predict processes queries in blocks, so that
+    the kernel matrix of a block stays within block_bytes, and sums kernels per class with a single
+    product with a one-hot label matrix. With n_neighbors only the kernels of that many closest
+    training points are summed, which is close to the full sum only when the kernel is narrow compared
+    to the spread of the data. Then for at most TREE_MAX_DIMS dimensions the neighbours come from
+    a BallTree, avoiding the full kernel matrix."""
+    TREE_MAX_DIMS = 15
+
+    def __init__(self, block_bytes=DEFAULT_BLOCK_BYTES, n_neighbors=None):
+        self.block_bytes = block_bytes
+        self.n_neighbors = n_neighbors
         self.features = None
         self.labels = None
+        self.tree = None
 
     def normalize(self, features):
         extended_features = np.c_[features, np.zeros(features.shape[0])]
@@ -14,23 +28,43 @@ class Parzen:
     def fit(self, features, labels):
         self.features = self.normalize(features)  # N x d
         self.labels = labels # N
-        self.unique_labels = np.unique(labels) # k
+        self.unique_labels, self.label_codes = np.unique(labels.ravel(), return_inverse=True) # k
         self.variance = 2 * labels.size
+        self.one_hot = sparse.csr_matrix(
+            (np.ones(self.label_codes.size), (np.arange(self.label_codes.size), self.label_codes)),
+            shape=(self.label_codes.size, self.unique_labels.size)
+        ) # N x k
+        self.tree = None
+        if self.n_neighbors is not None and self.features.shape[1] <= self.TREE_MAX_DIMS:
+            self.tree = BallTree(self.features)
+
+    def class_sums(self, features):
+        """Sums of kernels of normalized features with training points of every class, M x k."""
+        if self.n_neighbors is None:
+            sums = features @ self.features.T # M x d @ d x N = M x N
+            outputs = np.exp((sums - 1) / self.variance) # M x N
+            return np.asarray((self.one_hot.T @ outputs.T).T) # (k x N @ N x M).T = M x k
+
+        n_neighbors = min(self.n_neighbors, self.label_codes.size)
+        if self.tree is not None:
+            distances, closest = self.tree.query(features, n_neighbors)
+            sums = 1 - distances / 2  # squared distance of unit vectors is 2 - 2 x . y
+        else:
+            sums = features @ self.features.T
+            closest = np.argpartition(-sums, n_neighbors - 1, axis=1)[:, :n_neighbors]
+            sums = np.take_along_axis(sums, closest, axis=1)
+        outputs = np.exp((sums - 1) / self.variance) # M x n
+        class_num = self.unique_labels.size
+        positions = (np.arange(features.shape[0])[:, None] * class_num + self.label_codes[closest]).ravel()
+        return np.bincount(positions, outputs.ravel(), features.shape[0] * class_num).reshape(-1, class_num)
 
     def predict(self, features):
         points, dims = features.shape
-        class_num = self.unique_labels.size
 
         features = self.normalize(features)
-
-        sums = self.features @ features.T # N x d @ d x M = N x M
-        outputs = np.exp((sums - 1) / self.variance) # N x M
-        all_results = np.zeros((points, class_num), dtype=np.float) # M x k
-
-        for i, label in enumerate(self.unique_labels):
-            label_results = outputs.T @ (self.labels == label) # M x N @ N = M
-            all_results[:, i] = label_results
-
-        decisions = np.argmax(all_results, axis=1) # M
+        decisions = np.empty(points, dtype=np.intp) # M
+        step = block_rows(self.label_codes.size, self.block_bytes)
+        for start in range(0, points, step):
+            decisions[start:start + step] = np.argmax(self.class_sums(features[start:start + step]), axis=1)
 
         return self.unique_labels[decisions]
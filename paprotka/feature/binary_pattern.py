@@ -1,6 +1,9 @@
+import functools as ft
 import math
 import numpy as np
 
+MAX_TABLE_POINTS = 16
+
 
 def interpolate_bilinear(image, y, x):
     height, width = image.shape
@@ -25,32 +28,53 @@ def interpolate_bilinear(image, y, x):
     return (1 - frac_y) * top + frac_y * bot
 
 
-def local_binary_pattern(image):
-    HYPOT = 0.70711
-    POSITIONS = [(-HYPOT, -HYPOT), (-1, 0), (-HYPOT, HYPOT), (0, 1),
-                 (HYPOT, HYPOT), (1, 0), (HYPOT, -HYPOT), (0, -1)]
-    FIRST_WEIGHT = 128
-    patterns = np.zeros_like(image)
+def neighbour_offsets(radius=1, points=8):
+    """(dy, dx) of points on a circle, clockwise from the top left one, rounded to 5 decimal places."""
+    angles = 3 * np.pi / 4 - 2 * np.pi * np.arange(points) / points
+    return np.round(np.c_[-radius * np.sin(angles), radius * np.cos(angles)], 5) + 0.0
 
-    height, width = image.shape
-    for y in range(height):
-        for x in range(width):
-            pattern = 0
-            current = image[y, x]
-            for py, px in POSITIONS:
-                if current <= interpolate_bilinear(image, y + py, x + px):
-                    pattern = (pattern * 2) + 1
-                else:
-                    pattern *= 2
-
-            min_pattern = pattern
-            for i in range(7):
-                first = pattern & 1
-                pattern >>= 1
-                if first:
-                    pattern += FIRST_WEIGHT
-                if pattern < min_pattern:
-                    min_pattern = pattern
-            patterns[y, x] = min_pattern
-
-    return patterns
+
+@ft.lru_cache(maxsize=8)
+def rotation_minimums(points=8):
+    """Table mapping every points-bit code to the smallest code among its circular bit rotations."""
+    if points > MAX_TABLE_POINTS:
+        raise ValueError('at most {} points are supported, got {}'.format(MAX_TABLE_POINTS, points))
+    codes = np.arange(2 ** points, dtype=np.int64)
+    mask = 2 ** points - 1
+    minimums = codes.copy()
+    for shift in range(1, points):
+        np.minimum(minimums, ((codes >> shift) | (codes << (points - shift))) & mask, out=minimums)
+    return minimums.astype(np.min_scalar_type(mask))
+
+
+def neighbour_plane(padded, pad, shape, dy, dx):
+    """Bilinearly interpolated values at (y + dy, x + dx) of all pixels of images padded with zeros."""
+    floor_y, floor_x = math.floor(dy), math.floor(dx)
+    height, width = shape
+    # fractions of the actual coordinates, rounding like the interpolation of a single point
+    frac_y = ((np.arange(height) + dy) - (np.arange(height) + floor_y))[:, None]
+    frac_x = (np.arange(width) + dx) - (np.arange(width) + floor_x)
+
+    def shifted(sy, sx):
+        return padded[..., pad + sy:pad + sy + height, pad + sx:pad + sx + width]
+
+    top = (1 - frac_x) * shifted(floor_y, floor_x) + frac_x * shifted(floor_y, floor_x + 1)
+    bot = (1 - frac_x) * shifted(floor_y + 1, floor_x) + frac_x * shifted(floor_y + 1, floor_x + 1)
+    return (1 - frac_y) * top + frac_y * bot
+
+
+def local_binary_pattern(image, radius=1, points=8):
+    """Rotation invariant local binary patterns of an image or a stack of images (last two axes).
+    Every neighbour is compared with all pixels at once on an interpolated shifted plane of the image,
+    bits are set from the first neighbour being the most significant and turned into
+    the smallest of their rotations by a lookup table."""
+    image = np.asarray(image)
+    minimums = rotation_minimums(points)
+    pad = math.ceil(radius) + 1
+    padded = np.pad(image.astype(np.float64), [(0, 0)] * (image.ndim - 2) + [(pad, pad)] * 2)
+
+    codes = np.zeros(image.shape, dtype=np.int64)
+    for bit, (dy, dx) in zip(range(points - 1, -1, -1), neighbour_offsets(radius, points)):
+        codes |= (image <= neighbour_plane(padded, pad, image.shape[-2:], dy, dx)).astype(np.int64) << bit
+
+    return minimums[codes].astype(np.result_type(image.dtype, minimums.dtype))
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 
 
@@ -27,12 +28,69 @@ def central_moment(image, p, q, center=None):
 
 
 def scale_invariant(image, p, q, central00, center=None):
-    return central_moment(image, p, q) / (central00 ** (1 + (p + q) / 2))
+    return central_moment(image, p, q, center) / (central00 ** (1 + (p + q) / 2))
 
 
 eta = scale_invariant
 
 
+def _powers(coordinates, order):
+    """coordinates ** k for k up to order along a new last axis."""
+    return coordinates[..., None] ** np.arange(order + 1)
+
+
+def _shift_matrix(offsets, order):
+    """S[..., p, i] = binom(p, i) offset ** (p - i), turns moments around a point into moments
+    around the point moved by offset: M = S_x mu S_y^T."""
+    binomials = np.array([[math.comb(p, i) for i in range(order + 1)] for p in range(order + 1)], dtype=np.float64)
+    exponents = np.subtract.outer(np.arange(order + 1), np.arange(order + 1)).clip(0)
+    return binomials * np.asarray(offsets, dtype=np.float64)[..., None, None] ** exponents
+
+
+def moment_table(images, order=3, center=None):
+    """Raw, central and normalized moments of an image or a stack of images (last two axes) up to order,
+    each indexed [..., p, q] like moment(image, p, q). The central moments are computed in a single pass,
+    summing rows weighted by powers of row coordinates and then columns by powers of column coordinates,
+    and the raw ones are obtained from them with the binomial theorem. center is (row, column) or an array
+    of them for every image, if it is None images are assumed to be centered around (h/2, w/2)."""
+    images = np.asarray(images, dtype=np.float64)
+    height, width = images.shape[-2:]
+    if center is None:
+        center = (height / 2, width / 2)
+    center = np.asarray(center, dtype=np.float64)
+    center_row, center_col = center[..., 0], center[..., 1]
+
+    row_powers = _powers(np.arange(height) - center_row[..., None], order)  # ... x H x order + 1
+    col_powers = _powers(np.arange(width) - center_col[..., None], order)  # ... x W x order + 1
+    central = np.einsum('...hw,...wp,...hq->...pq', images, col_powers, row_powers, optimize=True)
+
+    raw = _shift_matrix(center_col, order) @ central @ np.swapaxes(_shift_matrix(center_row, order), -1, -2)
+
+    degrees = np.add.outer(np.arange(order + 1), np.arange(order + 1))
+    normalized = central / central[..., :1, :1] ** (1 + degrees / 2)
+    return raw, central, normalized
+
+
+def hu_invariants(images, center=None):
+    """All 7 Hu invariants of an image or a stack of images, ... x 7."""
+    eta = moment_table(images, 3, center)[2]
+    eta20, eta02, eta11 = eta[..., 2, 0], eta[..., 0, 2], eta[..., 1, 1]
+    eta30, eta03, eta21, eta12 = eta[..., 3, 0], eta[..., 0, 3], eta[..., 2, 1], eta[..., 1, 2]
+    sum_30_12, sum_21_03 = eta30 + eta12, eta21 + eta03
+    diff_30_12, diff_21_03 = eta30 - 3 * eta12, 3 * eta21 - eta03
+    return np.stack([
+        eta20 + eta02,
+        (eta20 - eta02) ** 2 + 4 * eta11 ** 2,
+        diff_30_12 ** 2 + diff_21_03 ** 2,
+        sum_30_12 ** 2 + sum_21_03 ** 2,
+        diff_30_12 * sum_30_12 * (sum_30_12 ** 2 - 3 * sum_21_03 ** 2)
+        + diff_21_03 * sum_21_03 * (3 * sum_30_12 ** 2 - sum_21_03 ** 2),
+        (eta20 - eta02) * (sum_30_12 ** 2 - sum_21_03 ** 2) + 4 * eta11 * sum_30_12 * sum_21_03,
+        diff_21_03 * sum_30_12 * (sum_30_12 ** 2 - 3 * sum_21_03 ** 2)
+        - diff_30_12 * sum_21_03 * (3 * sum_30_12 ** 2 - sum_21_03 ** 2),
+    ], axis=-1)
+
+
 def first_hu_invariant(im):
     cm00 = central_moment(im, 0, 0)
     return eta(im, 2, 0, cm00) + eta(im, 0, 2, cm00)
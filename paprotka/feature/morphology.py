@@ -1,9 +1,11 @@
 import heapq as hq
 import math
 import numpy as np
-from paprotka.struct.union import Union
+from paprotka.struct.union import DisjointSet
 from .moment import moment
 
+CONNECTIVITY_REACH = {4: 0, 8: 1}
+
 
 def erode_image(image, by=1):
     new_image = image
@@ -104,48 +106,68 @@ def distance_to_background(background):
     return distances
 
 
-def label_unique(image, start=2):
+def find_runs(image):
+    """Rows, starts and exclusive ends of horizontal runs of nonzero pixels in raster order."""
+    padded = np.zeros((image.shape[0], image.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = image != 0
+    changes = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(changes == 1)
+    ends = np.nonzero(changes == -1)[1]
+    return rows, starts, ends
+
+
+def touching_runs(rows, starts, ends, width, connectivity=8):
+    """Pairs of indices of runs in consecutive rows touching each other. Runs of a row touching
+    a run of the next one are contiguous, so they are found by binary search of their bounds."""
+    if connectivity not in CONNECTIVITY_REACH:
+        raise ValueError('unknown connectivity {}'.format(connectivity))
+    reach = CONNECTIVITY_REACH[connectivity]
+    stride = width + 2  # keys of different rows never mix
+    previous_row = (rows - 1) * stride
+    firsts = np.searchsorted(rows * stride + ends, previous_row + starts - reach, side='right')
+    lasts = np.searchsorted(rows * stride + starts, previous_row + ends + reach, side='left')
+    counts = np.maximum(lasts - firsts, 0)
+
+    lower = np.repeat(np.arange(rows.size), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    upper = np.repeat(firsts, counts) + offsets
+    return upper, lower
+
+
+def label_components(image, connectivity=8, start=1, return_stats=False):
+    """Labels connected components of nonzero pixels with consecutive numbers from start, ordered
+    by their first pixel in raster order. Works on horizontal runs of pixels, merged with a disjoint
+    set when they touch runs in the previous row. With return_stats also returns a dict with area,
+    bbox (top, left, bottom, right, exclusive) and centroid (row, col) of every component,
+    computed from the same runs."""
     height, width = image.shape
-    classes = np.zeros(image.shape, dtype=np.int32) - 1
-    unions = []
-
-    next_unique = 1
-    for row in range(height):
-        for col in range(width):
-            if image[row, col]:
-                neighbors = []
-                if row > 0:
-                    if col > 0 and classes[row - 1, col - 1] >= 0:
-                        neighbors.append((row - 1, col - 1))
-                    if classes[row - 1, col] >= 0:
-                        neighbors.append((row - 1, col))
-                    if col < width - 1 and classes[row - 1, col + 1] >= 0:
-                        neighbors.append((row - 1, col + 1))
-                if col > 0 and classes[row, col - 1] >= 0:
-                    neighbors.append((row, col - 1))
-
-                if len(neighbors) == 0:
-                    classes[row, col] = len(unions)
-                    unions.append(Union(next_unique))
-                    next_unique += 1
-                else:
-                    frow, fcol = neighbors[0]
-                    first_class = classes[frow, fcol]
-                    classes[row, col] = first_class
-                    union = unions[first_class]
-                    for nrow, ncol in neighbors[1:]:
-                        unions[classes[nrow, ncol]].merge(union, min)
-
-    label_mapping = {}
-    labels = np.zeros(image.shape, dtype=np.uint16)
-    for row in range(height):
-        for col in range(width):
-            if image[row, col]:
-                union = unions[classes[row, col]]
-                unique = union.getv()
-                if unique not in label_mapping:
-                    label_mapping[unique] = start
-                    start += 1
-                labels[row, col] = label_mapping[unique]
+    rows, starts, ends = find_runs(image)
+    runs = DisjointSet(rows.size)
+    runs.union_pairs(*touching_runs(rows, starts, ends, width, connectivity))
+    # roots are the first runs of components, so their order is the raster order
+    roots, components = np.unique(runs.find_all(), return_inverse=True)
+
+    lengths = ends - starts
+    labels = np.zeros(image.shape, dtype=np.int32)
+    run_offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    labels.ravel()[np.repeat(rows * width + starts, lengths) + run_offsets] = np.repeat(components + start, lengths)
+    if not return_stats:
+        return labels
+
+    count = roots.size
+    area = np.bincount(components, lengths, count).astype(np.int64)
+    bbox = np.empty((count, 4), dtype=np.intp)
+    bbox[:, 0] = rows[roots]
+    bbox[:, 1] = width
+    np.minimum.at(bbox[:, 1], components, starts)
+    bbox[:, 2:] = 0
+    np.maximum.at(bbox[:, 2], components, rows + 1)
+    np.maximum.at(bbox[:, 3], components, ends)
+    centroid = np.c_[np.bincount(components, rows * lengths, count),
+                     np.bincount(components, lengths * (starts + ends - 1) / 2, count)] / area[:, None]
+    return labels, {'area': area, 'bbox': bbox, 'centroid': centroid}
 
-    return labels
+
+def label_unique(image, start=2):
+    """8-connected components numbered from start in raster order of their first pixels."""
+    return label_components(image, 8, start).astype(np.uint16)
@@ -1,6 +1,10 @@
+import collections
 import math
 import numpy as np
 
+GATHER_CACHE_BYTES = 256 * 2 ** 20
+_gather_cache = collections.OrderedDict()
+
 
 def make_rotation_matrix(angle):
     return np.array([[math.cos(angle), -math.sin(angle)],
@@ -19,14 +23,79 @@ def interpolate_bilinear(image, point):
     return weights_before.dot(values).dot(weights_after)
 
 
-def rotate_image(image, angle):
+def rotation_sources(shape, angle):
+    """Source coordinates of every pixel of an image of shape rotated by angle around its center, H x W each."""
     rev_matrix = make_rotation_matrix(-angle)
-    height, width = image.shape
-    center_translation = np.array([height / 2, width / 2])
-    result = np.zeros(image.shape)
-    height, width = image.shape
-    for row in range(height):
-        for col in range(width):
-            source = np.dot(rev_matrix, [row, col] - center_translation) + center_translation
-            result[row, col] = interpolate_bilinear(image, source)
-    return result
+    height, width = shape
+    center_y, center_x = height / 2, width / 2
+    rows = np.arange(height, dtype=np.float64)[:, None] - center_y
+    cols = np.arange(width, dtype=np.float64)[None, :] - center_x
+    ys = rev_matrix[0, 0] * rows + rev_matrix[0, 1] * cols + center_y
+    xs = rev_matrix[1, 0] * rows + rev_matrix[1, 1] * cols + center_x
+    return ys, xs
+
+
+def rotation_gather(shape, angle, interpolation='bilinear'):
+    """Flat positions of source pixels of every pixel and their weights, cached per shape and angle.
+    Bilinear interpolation returns positions of 4 corners and weights of rows and columns,
+    nearest neighbour only positions of the closest pixels. The least recently used entries
+    are dropped once the cache holds more than GATHER_CACHE_BYTES."""
+    key = (tuple(shape), angle, interpolation)
+    if key in _gather_cache:
+        _gather_cache.move_to_end(key)
+        return _gather_cache[key]
+
+    gather = _rotation_gather(shape, angle, interpolation)
+    _gather_cache[key] = gather
+    while sum(_gather_bytes(cached) for cached in _gather_cache.values()) > GATHER_CACHE_BYTES:
+        _gather_cache.popitem(last=False)
+    return gather
+
+
+def _gather_bytes(gather):
+    return sum(array.nbytes for array in gather if array is not None)
+
+
+def _rotation_gather(shape, angle, interpolation):
+    height, width = shape
+    index_type = np.int32 if height * width <= np.iinfo(np.int32).max else np.intp
+    ys, xs = rotation_sources(shape, angle)
+    if interpolation == 'nearest':
+        rows = np.floor(ys + 0.5).astype(index_type).clip(0, height - 1)
+        cols = np.floor(xs + 0.5).astype(index_type).clip(0, width - 1)
+        return _read_only(rows * width + cols), None
+    if interpolation != 'bilinear':
+        raise ValueError('unknown interpolation {}'.format(interpolation))
+
+    # coordinates outside the image are clipped first, so samples there repeat the edge instead of extrapolating
+    ys, xs = ys.clip(0, height - 1), xs.clip(0, width - 1)
+    y1, x1 = np.floor(ys), np.floor(xs)
+    rows = [(y1 + shift).astype(index_type).clip(0, height - 1) for shift in (0, 1)]
+    cols = [(x1 + shift).astype(index_type).clip(0, width - 1) for shift in (0, 1)]
+    positions = np.stack([row * width + col for row in rows for col in cols])  # 4 x H x W
+    weights = np.stack([y1 + 1 - ys, ys - y1, x1 + 1 - xs, xs - x1]).astype(np.float32)  # 4 x H x W
+    return _read_only(positions), _read_only(weights)
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+def rotate_image(image, angle, interpolation='bilinear'):
+    """Rotates an image or a stack of images (last two axes) by angle around the center,
+    gathering source pixels of all pixels at once. Pixels taken from outside the image
+    repeat its edge."""
+    image = np.asarray(image)
+    shape = image.shape[-2:]
+    positions, weights = rotation_gather(shape, float(angle), interpolation)
+    flat = image.reshape(image.shape[:-2] + (-1,))
+    if weights is None:
+        return flat[..., positions].astype(np.float64)
+
+    flat = flat.astype(np.float64, copy=False)  # so the result stays float64 with float32 weights
+
+    top_left, top_right, bottom_left, bottom_right = (flat[..., corner] for corner in positions)
+    weight_top, weight_bottom, weight_left, weight_right = weights
+    return ((weight_top * top_left + weight_bottom * bottom_left) * weight_left
+            + (weight_top * top_right + weight_bottom * bottom_right) * weight_right)
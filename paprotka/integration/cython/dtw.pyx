@@ -0,0 +1,44 @@
+cimport cython
+from libc.math cimport INFINITY
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def accumulate_banded(double[:, ::1] cost, const Py_ssize_t[::1] lo, const Py_ssize_t[::1] hi, double cutoff):
+    """Turns banded costs, cell (i, j) stored at cost[i, j - lo[i]] for j in [lo[i], hi[i]), into accumulated
+    DTW costs in place. Returns the total cost or infinity once a whole row exceeds cutoff."""
+    cdef Py_ssize_t rows = cost.shape[0]
+    cdef Py_ssize_t i, k, width, shift, above_width
+    cdef double best, left, row_min
+
+    cdef double result = INFINITY
+
+    with nogil:
+        for i in range(rows):
+            row_min = INFINITY
+            width = hi[i] - lo[i]
+            left = INFINITY
+            if i > 0:
+                shift = lo[i] - lo[i - 1]  # cell k of this row is above cell k + shift of the previous one
+                above_width = hi[i - 1] - lo[i - 1]
+            for k in range(width):
+                if i == 0:
+                    best = 0 if k == 0 else left
+                else:
+                    best = left
+                    if k + shift < above_width and cost[i - 1, k + shift] < best:
+                        best = cost[i - 1, k + shift]
+                    if 0 < k + shift <= above_width and cost[i - 1, k + shift - 1] < best:
+                        best = cost[i - 1, k + shift - 1]
+
+                left = cost[i, k] + best
+                cost[i, k] = left
+                if left < row_min:
+                    row_min = left
+
+            if row_min > cutoff:
+                break
+        else:
+            result = cost[rows - 1, hi[rows - 1] - 1 - lo[rows - 1]]
+
+    return result
@@ -8,10 +8,118 @@ METRICS = {
     'chebyshev': lambda x, y: np.max(np.abs(x - y))
 }
 
+# METRICS raised to the power of 1 / exponent satisfy the triangle inequality
+METRIC_EXPONENTS = {
+    'manhattan': 1,
+    'euclidean': 2,
+    'chebyshev': 1
+}
+
+DEFAULT_BLOCK_BYTES = 64 * 2 ** 20
+SMALL_ROWS = 16
+
+
+def manhattan_distances(first, second):
+    result = np.zeros((first.shape[0], second.shape[0]), dtype=np.float64)
+    for column in range(first.shape[1]):
+        result += np.abs(first[:, column, None] - second[None, :, column])
+    return result
+
+
+def euclidean_distances(first, second):
+    if second.shape[0] <= SMALL_ROWS:  # exact differences, the product gains nothing here
+        result = np.zeros((first.shape[0], second.shape[0]), dtype=np.float64)
+        for column in range(first.shape[1]):
+            result += np.square(first[:, column, None] - second[None, :, column])
+        return result
+
+    first_norms = np.einsum('ij,ij->i', first, first)
+    second_norms = np.einsum('ij,ij->i', second, second)
+    result = first @ second.T
+    result *= -2
+    result += first_norms[:, None]
+    result += second_norms[None, :]
+    return np.maximum(result, 0, out=result)
+
+
+def minkowski3_distances(first, second):
+    # sum((x - y) ** 3) = sum(x ** 3) - 3 x ** 2 . y + 3 x . y ** 2 - sum(y ** 3)
+    result = np.square(first) @ second.T
+    result -= first @ np.square(second).T
+    result *= -3
+    result += np.power(first, 3).sum(axis=1)[:, None]
+    result -= np.power(second, 3).sum(axis=1)[None, :]
+    return result
+
+
+def chebyshev_distances(first, second):
+    result = np.zeros((first.shape[0], second.shape[0]), dtype=np.float64)
+    for column in range(first.shape[1]):
+        np.maximum(result, np.abs(first[:, column, None] - second[None, :, column]), out=result)
+    return result
+
+
+PAIRWISE_METRICS = {
+    'manhattan': manhattan_distances,
+    'euclidean': euclidean_distances,
+    'minkowski3': minkowski3_distances,
+    'chebyshev': chebyshev_distances
+}
+
+_METRIC_NAMES = {metric: name for name, metric in METRICS.items()}
+
+
+def metric_name(metric):
+    """Returns the registry name of a metric given either its name, its METRICS lambda or its pairwise function."""
+    if isinstance(metric, str):
+        return metric if metric in METRICS else None
+    if metric in _METRIC_NAMES:
+        return _METRIC_NAMES[metric]
+    for name, pairwise in PAIRWISE_METRICS.items():
+        if metric is pairwise:
+            return name
+    return None
+
+
+def get_pairwise_metric(metric):
+    """Accepts a metric name, a METRICS lambda or a vectorized callable taking (first, second) matrices
+    and returning the matrix of their distances."""
+    if isinstance(metric, str):
+        return PAIRWISE_METRICS[metric]
+    name = metric_name(metric)
+    if name is not None:
+        return PAIRWISE_METRICS[name]
+    return metric
+
+
+def block_rows(second_rows, block_bytes=DEFAULT_BLOCK_BYTES, itemsize=8):
+    return max(1, block_bytes // (max(1, second_rows) * itemsize * 2))
+
+
+def iterate_pairwise_distances(metric, first, second, block_bytes=DEFAULT_BLOCK_BYTES):
+    """Yields (start, distances) where distances are between first[start:start + len(distances)] and second."""
+    pairwise = get_pairwise_metric(metric)
+    first = np.asarray(first, dtype=np.float64)
+    second = np.asarray(second, dtype=np.float64)
+    step = block_rows(second.shape[0], block_bytes)
+    for start in range(0, first.shape[0], step):
+        yield start, pairwise(first[start:start + step], second)
+
+
+def pairwise_distances(metric, first, second, block_bytes=DEFAULT_BLOCK_BYTES):
+    """result[i, j] equals METRICS[metric](first[i], second[j]), computed in blocks of first's rows
+    so that temporaries stay within block_bytes."""
+    result = np.empty((len(first), len(second)), dtype=np.float64)
+    for start, distances in iterate_pairwise_distances(metric, first, second, block_bytes):
+        result[start:start + distances.shape[0]] = distances
+    return result
+
 
 def calculate_distances(metric, matrix, point):
-    row_num, _ = matrix.shape
-    distances = np.zeros(row_num)
-    for i in range(row_num):
-        distances[i] = metric(matrix[i], point)
-    return distances
+    if metric_name(metric) is None:
+        row_num, _ = matrix.shape
+        distances = np.zeros(row_num)
+        for i in range(row_num):
+            distances[i] = metric(matrix[i], point)
+        return distances
+    return pairwise_distances(metric, matrix, np.asarray(point).reshape(1, -1))[:, 0]
@@ -0,0 +1,57 @@
+import concurrent.futures as cf
+import contextlib
+import functools as ft
+import os
+import tempfile
+import numpy as np
+from paprotka.archive import load_arrays, save_arrays
+
+SHARED_DIR = '/dev/shm'
+
+
+def resolve_n_jobs(n_jobs):
+    """None means one worker, negative values count back from the number of cores like in scikit-learn."""
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return max(1, n_jobs)
+
+
+def make_executor(n_jobs, backend='process', initializer=None, initargs=()):
+    if backend == 'process':
+        return cf.ProcessPoolExecutor(resolve_n_jobs(n_jobs), initializer=initializer, initargs=initargs)
+    if backend == 'thread':
+        return cf.ThreadPoolExecutor(resolve_n_jobs(n_jobs), initializer=initializer, initargs=initargs)
+    raise ValueError('unknown backend {}'.format(backend))
+
+
+def split_ranges(size, parts):
+    """Splits range(size) into at most parts contiguous, non-empty (start, end) ranges of similar size."""
+    bounds = np.linspace(0, size, max(1, min(parts, size)) + 1).astype(np.intp)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+@contextlib.contextmanager
+def shared_arrays(arrays, attributes=None):
+    """Writes arrays into a temporary archive, in shared memory when available, and yields its path.
+    Worker processes get read-only memory maps of it through load_shared instead of pickled copies."""
+    directory = SHARED_DIR if os.path.isdir(SHARED_DIR) else None
+    handle, path = tempfile.mkstemp(suffix='.arrays', dir=directory)
+    os.close(handle)
+    try:
+        save_arrays(path, arrays, attributes)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def load_shared(path):
+    """Maps an archive from shared_arrays once per worker process."""
+    stat = os.stat(path)
+    return _load_shared(path, stat.st_ino, stat.st_mtime_ns)
+
+
+@ft.lru_cache(maxsize=8)
+def _load_shared(path, inode, modified):
+    return load_arrays(path, mmap=True)
@@ -1,102 +1,579 @@
-import heapq as hq
-import math
-import random
+import contextlib
+import os
+import weakref
 import numpy as np
-from paprotka.metric import METRICS, calculate_distances
+from paprotka.archive import load_arrays, save_arrays
+from paprotka.metric import METRIC_EXPONENTS, get_pairwise_metric, metric_name
+from paprotka.parallel import load_shared, make_executor, resolve_n_jobs, shared_arrays, split_ranges
+
+FIND_SLACK = 1e-9
+DUAL_BLOCK_SIZE = 64
+DUAL_LEAF_CHUNK = 16
+SUBTREES_PER_JOB = 4
+
+
+def _ball(points, pairwise):
+    pivot = points.mean(axis=0)
+    return pivot, pairwise(points, pivot[None, :])[:, 0].max()
+
+
+def _split_node(points, indices, start, end, pairwise, seed):
+    """Reorders indices[start:end] so that points closer to the first of two distant pivots come first.
+    Returns the split position with balls around both halves or None if the node can't be split."""
+    rng = np.random.default_rng(seed)
+    node_indices = indices[start:end]
+    node_points = points[node_indices]
+    first = node_points[rng.integers(end - start)]
+    left_pivot = node_points[np.argmax(pairwise(node_points, first[None, :])[:, 0])]
+    right_pivot = node_points[np.argmax(pairwise(node_points, left_pivot[None, :])[:, 0])]
+    distances = pairwise(node_points, np.array([left_pivot, right_pivot]))
+    closer_to_left = distances[:, 0] < distances[:, 1]
+    left_num = np.count_nonzero(closer_to_left)
+    if left_num == 0 or left_num == end - start:  # all points the same
+        return None
+
+    indices[start:end] = np.concatenate([node_indices[closer_to_left], node_indices[~closer_to_left]])
+    balls = _ball(node_points[closer_to_left], pairwise), _ball(node_points[~closer_to_left], pairwise)
+    return start + left_num, balls
+
+
+def build_nodes(points, indices, start, end, pivot, radius, leaf_size, pairwise, seed, frontier_size=None):
+    """Builds the subtree over indices[start:end] iteratively, reordering indices in place. Nodes
+    with at most frontier_size points are left unsplit and listed in 'pending' with their seeds,
+    so that their subtrees can be built independently and grafted."""
+    pivots, radii, children, bounds, pending = [], [], [], [], []
+    stack = [(-1, 0, start, end, pivot, radius, seed)]
+    while stack:
+        parent, side, node_start, node_end, node_pivot, node_radius, node_seed = stack.pop()
+        node = len(pivots)
+        if parent >= 0:
+            children[parent][side] = node
+        pivots.append(node_pivot)
+        radii.append(node_radius)
+        children.append([-1, -1])
+        bounds.append((node_start, node_end))
+
+        if node_end - node_start < leaf_size:
+            continue
+        if frontier_size is not None and node_end - node_start <= frontier_size:
+            pending.append((node, node_seed))
+            continue
+        split = _split_node(points, indices, node_start, node_end, pairwise, node_seed)
+        if split is None:
+            continue
+        middle, (left_ball, right_ball) = split
+        left_seed, right_seed = node_seed.spawn(2)
+        stack.append((node, 1, middle, node_end) + right_ball + (right_seed,))
+        stack.append((node, 0, node_start, middle) + left_ball + (left_seed,))
+
+    return {
+        'pivots': np.array(pivots, dtype=np.float64).reshape(len(pivots), points.shape[1]),
+        'radii': np.array(radii, dtype=np.float64),
+        'children': np.array(children, dtype=np.intp).reshape(-1, 2),
+        'bounds': np.array(bounds, dtype=np.intp).reshape(-1, 2),
+        'pending': pending
+    }
+
+
+def build_subtree(points, indices, pivot, radius, leaf_size, metric, seed):
+    """Builds nodes over given indices of points, which may be the path of an archive from shared_arrays."""
+    if isinstance(points, str):
+        points = load_shared(points)[0]['points']
+    indices = indices.copy()
+    nodes = build_nodes(points, indices, 0, indices.size, pivot, radius, leaf_size, get_pairwise_metric(metric), seed)
+    return indices, nodes
+
+
+def graft_nodes(nodes, subtrees):
+    """Replaces pending nodes with roots of (node, subtree) pairs, appending all the other subtree nodes."""
+    pivots, radii, children, bounds = [nodes['pivots']], [nodes['radii']], nodes['children'].copy(), [nodes['bounds']]
+    grafted_children = []
+    offset = nodes['radii'].size
+    for node, subtree in subtrees:
+        count = subtree['radii'].size
+        ids = np.concatenate([[node], np.arange(offset, offset + count - 1)])
+        subtree_children = np.where(subtree['children'] >= 0, ids[subtree['children']], -1)
+        children[node] = subtree_children[0]
+        grafted_children.append(subtree_children[1:])
+        pivots.append(subtree['pivots'][1:])
+        radii.append(subtree['radii'][1:])
+        bounds.append(subtree['bounds'][1:] + nodes['bounds'][node, 0])
+        offset += count - 1
+    return {
+        'pivots': np.concatenate(pivots),
+        'radii': np.concatenate(radii),
+        'children': np.concatenate([children] + grafted_children),
+        'bounds': np.concatenate(bounds)
+    }
 
 
 class BallTree:
-    points = None
-    labels = None
-    left = None
-    right = None
+    """Ball tree stored as flat node arrays. Node i covers points[bounds[i, 0]:bounds[i, 1]], which
+    is the part of the input reordered by the permutation indices, and has a ball described by
+    pivots[i] and radii[i]. Leaves have children[i] == (-1, -1).
+
+    With n_jobs the top levels are built first and the remaining subtrees are built by a pool of
+    workers. Every node draws its pivots from its own seed spawned from random_state, so the tree
+    doesn't depend on n_jobs or on the order in which workers finish. Process pools querying the tree
+    map the file it was loaded from with mmap, or one archive in shared memory written on first use."""
+    NODE_ARRAYS = ('points', 'indices', 'pivots', 'radii', 'children', 'bounds')
 
-    def __init__(self, points, labels, pivot=None, radius=None, leaf_size=20, metric=METRICS['euclidean']):
-        self.pivot = pivot
-        self.radius = radius
-        self.metric = metric
+    def __init__(self, points, labels=None, leaf_size=20, metric='euclidean', random_state=None,
+                 n_jobs=1, backend='process'):
+        points = np.asarray(points, dtype=np.float64)
+        self._set_metric(metric)
+        self.leaf_size = leaf_size
+        self.labels = None if labels is None else np.asarray(labels)
+        self.path = None
 
         row_num, _ = points.shape
-        if row_num < leaf_size:
-            self.leaf = True
-            self.points = points
-            self.labels = labels
-        else:
-            self.leaf = False
-
-            left_ix, right_ix = random.sample(range(row_num), 2)
-            left_pivot, right_pivot = points[left_ix], points[right_ix]
-            left_distances = calculate_distances(metric, points, left_pivot)
-            right_distances = calculate_distances(metric, points, right_pivot)
-            closer_to_left = left_distances < right_distances
-            closer_to_right = np.logical_not(closer_to_left)
-
-            if closer_to_left.any() and closer_to_right.any():
-                left_radius = left_distances[closer_to_left].max()
-                right_radius = right_distances[closer_to_right].max()
-                self.left = BallTree(points[closer_to_left], labels[closer_to_left], left_pivot, left_radius, leaf_size,
-                                     metric)
-                self.right = BallTree(points[closer_to_right], labels[closer_to_right], right_pivot, right_radius,
-                                      leaf_size, metric)
-            else:  # all points the same
-                self.leaf = True
-                self.points = points
-                self.labels = labels
+        indices = np.arange(row_num)
+        pivot, radius = _ball(points, self.pairwise) if row_num > 0 else (np.zeros(points.shape[1]), 0.0)
+        seed = np.random.SeedSequence(random_state)
+        n_jobs = resolve_n_jobs(n_jobs)
+        frontier_size = max(leaf_size, row_num // (n_jobs * SUBTREES_PER_JOB)) if n_jobs > 1 else None
+        nodes = build_nodes(points, indices, 0, row_num, pivot, radius, leaf_size, self.pairwise, seed, frontier_size)
+        if nodes['pending']:
+            nodes = self._build_pending(points, indices, nodes, n_jobs, backend)
+
+        self.indices = indices
+        self.points = np.ascontiguousarray(points[indices])
+        self.pivots = nodes['pivots']
+        self.radii = nodes['radii']
+        self.children = nodes['children']
+        self.bounds = nodes['bounds']
+
+    def _build_pending(self, points, indices, nodes, n_jobs, backend):
+        tasks = []
+        for node, seed in nodes['pending']:
+            start, end = nodes['bounds'][node]
+            tasks.append((node, start, end, nodes['pivots'][node], nodes['radii'][node], seed))
+
+        with contextlib.ExitStack() as stack:
+            executor = stack.enter_context(make_executor(n_jobs, backend))
+            source = points
+            if backend == 'process':
+                source = stack.enter_context(shared_arrays({'points': points}))
+            futures = [executor.submit(build_subtree, source, indices[start:end], pivot, radius,
+                                       self.leaf_size, self.metric, seed)
+                       for _, start, end, pivot, radius, seed in tasks]
+            subtrees = []
+            for (node, start, end, _, _, _), future in zip(tasks, futures):
+                subtree_indices, subtree = future.result()
+                indices[start:end] = subtree_indices
+                subtrees.append((node, subtree))
+        return graft_nodes(nodes, subtrees)
+
+    def _set_metric(self, metric):
+        self.metric = metric_name(metric) or metric
+        self.pairwise = get_pairwise_metric(metric)
+        self.exponent = METRIC_EXPONENTS.get(self.metric) if isinstance(self.metric, str) else None
+
+    def to_arrays(self):
+        if not isinstance(self.metric, str):
+            raise ValueError('only trees using a named metric can be stored')
+        arrays = {name: getattr(self, name) for name in self.NODE_ARRAYS}
+        if self.labels is not None:
+            arrays['labels'] = self.labels
+        return arrays, {'metric': self.metric, 'leaf_size': int(self.leaf_size)}
+
+    @classmethod
+    def from_arrays(cls, arrays, attributes):
+        tree = cls.__new__(cls)
+        tree._set_metric(attributes['metric'])
+        tree.leaf_size = attributes['leaf_size']
+        tree.labels = arrays.get('labels')
+        tree.path = None
+        for name in cls.NODE_ARRAYS:
+            setattr(tree, name, arrays[name])
+        return tree
+
+    def save(self, path):
+        save_arrays(path, *self.to_arrays())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """With mmap the node arrays and points stay in the file and are shared by all processes loading it."""
+        tree = cls.from_arrays(*load_arrays(path, mmap))
+        if mmap:
+            tree.path = os.path.abspath(path)
+        return tree
+
+    def _shared_path(self):
+        """Path of an archive of the tree for worker processes, the file it was loaded from with mmap
+        or one written into shared memory once and removed with the tree."""
+        if self.path is None or not os.path.exists(self.path):  # copies may outlive the archive of the original
+            arrays, attributes = self.to_arrays()
+            arrays.pop('labels', None)
+            stack = contextlib.ExitStack()
+            self.path = stack.enter_context(shared_arrays(arrays, attributes))
+            weakref.finalize(self, stack.close)
+        return self.path
+
+    def lower_bounds(self, distances, *radii):
+        """Smallest possible distance between points inside balls given the distance of their pivots."""
+        if self.exponent is None:
+            return distances - sum(radii)
+        root = 1.0 / self.exponent
+        bounds = np.power(distances, root) - sum(np.power(radius, root) for radius in radii)
+        return np.maximum(bounds, 0) ** self.exponent
+
+    def upper_bounds(self, distances, *radii):
+        """Largest possible distance between points inside balls or None if the metric doesn't bound it."""
+        if self.exponent is None:
+            return None
+        root = 1.0 / self.exponent
+        return (np.power(distances, root) + sum(np.power(radius, root) for radius in radii)) ** self.exponent
+
+    def is_leaf(self, node):
+        return self.children[node, 0] < 0
 
     def depth(self):
-        if self.leaf:
-            return 1
-        else:
-            return 1 + max(self.left.depth(), self.right.depth())
+        depths = np.ones(self.node_count(), dtype=np.intp)
+        for node in range(self.node_count()):
+            for child in self.children[node]:
+                if child >= 0:
+                    depths[child] = depths[node] + 1
+        return depths.max()
 
     def node_count(self):
-        if self.leaf:
-            return 1
-        else:
-            return 1 + self.left.node_count() + self.right.node_count()
+        return self.radii.size
 
     def size(self):
-        if self.leaf:
-            row_num, _ = self.points.shape
-            return row_num
-        else:
-            return self.left.size() + self.right.size()
+        row_num, _ = self.points.shape
+        return row_num
 
     def find(self, point):
-        if self.leaf:
-            pos, = np.where((self.points == point).all(axis=1))
-            return self.labels[pos] if pos.size > 0 else None
-        else:
-            left_distance = self.metric(self.left.pivot, point)
-            right_distance = self.metric(self.right.pivot, point)
-            downstream = self.left if left_distance < right_distance else self.right
-            return downstream.find(point)
+        point = np.asarray(point, dtype=np.float64).reshape(1, -1)
+        matches = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            start, end = self.bounds[node]
+            if self.is_leaf(node):
+                pos, = np.where((self.points[start:end] == point).all(axis=1))
+                matches.append(self.indices[start + pos])
+            else:
+                children = self.children[node]
+                distances = self.pairwise(point, self.pivots[children])[0]
+                inside = self.lower_bounds(distances, self.radii[children]) <= FIND_SLACK * (1 + self.radii[children])
+                stack.extend(children[inside])
+        if matches:
+            matches = np.sort(np.concatenate(matches))
+        if len(matches) == 0:
+            return None
+        return matches if self.labels is None else self.labels[matches]
 
-    def find_k_nearest(self, k, reference):
+    def _sharded(self, method, points, n_jobs, backend, *args):
+        """Runs a query method over parts of points in a pool, processes map the tree from _shared_path."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, self.points.shape[1])
+        ranges = split_ranges(points.shape[0], resolve_n_jobs(n_jobs))
+        if len(ranges) <= 1:
+            return getattr(self, method)(points, *args)
+
+        with make_executor(n_jobs, backend) as executor:
+            if backend == 'process':
+                path = self._shared_path()
+                futures = [executor.submit(query_shared, path, method, points[start:end], args)
+                           for start, end in ranges]
+            else:
+                futures = [executor.submit(getattr(self, method), points[start:end], *args)
+                           for start, end in ranges]
+            parts = [future.result() for future in futures]
+
+        if isinstance(parts[0], tuple):
+            return tuple(np.concatenate(part) for part in zip(*parts))
+        return np.concatenate(parts)
+
+    def query(self, points, k=1, return_distance=True, n_jobs=1, backend='process'):
+        """Finds k nearest neighbours of every row of points. Returns arrays of shape (len(points), k)
+        with distances and positions of the neighbours in the original data, both sorted by distance."""
+        if resolve_n_jobs(n_jobs) > 1:
+            return self._sharded('_query', points, n_jobs, backend, k, return_distance)
+        return self._query(points, k, return_distance)
+
+    def _query(self, points, k, return_distance):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, self.points.shape[1])
+        query_num = points.shape[0]
         k = min(k, self.size())
-        best = [(-math.inf, None) for _ in range(k)]
-        hq.heapify(best)
-        self._find_k_nearest(k, reference, best)
-        return [pair[1] for pair in best]
-
-    def _find_k_nearest(self, k, reference, best):
-        if self.leaf:
-            distances = calculate_distances(self.metric, self.points, reference)
-            k_closest = np.argpartition(distances, k - 1)[:k] if k <= distances.size else range(distances.size)
-            for pos in k_closest:
-                hq.heappushpop(best, (-distances[pos], self.labels[pos]))
+
+        best_distances = np.full((query_num, k), np.inf)
+        best_indices = np.full((query_num, k), -1, dtype=np.intp)
+        kth_distances = np.full(query_num, np.inf)
+
+        if k > 0 and query_num > 0:
+            root_distances = self.pairwise(points, self.pivots[:1])[:, 0]
+            root_bounds = self.lower_bounds(root_distances, self.radii[0])
+            stack = [(0, np.arange(query_num), root_bounds)]
+            while stack:
+                node, queries, bounds = stack.pop()
+                close = bounds <= kth_distances[queries]
+                queries = queries[close]
+                if queries.size == 0:
+                    continue
+
+                start, end = self.bounds[node]
+                if self.is_leaf(node):
+                    distances = self.pairwise(points[queries], self.points[start:end])
+                    leaf_indices = np.broadcast_to(self.indices[start:end], distances.shape)
+                    merged_distances, merged_indices = merge_nearest(
+                        best_distances[queries], best_indices[queries], distances, leaf_indices, k
+                    )
+                    best_distances[queries] = merged_distances
+                    best_indices[queries] = merged_indices
+                    kth_distances[queries] = merged_distances.max(axis=1)
+                else:
+                    self._push_children(stack, node, points, queries)
+
+        order = np.argsort(best_distances, axis=1, kind='stable')
+        best_indices = np.take_along_axis(best_indices, order, axis=1)
+        if not return_distance:
+            return best_indices
+        return np.take_along_axis(best_distances, order, axis=1), best_indices
+
+    def _push_children(self, stack, node, points, queries):
+        """Pushes both children so that the one closer to most of the queries is visited first."""
+        left, right = self.children[node]
+        distances = self.pairwise(points[queries], self.pivots[[left, right]])
+        bounds = self.lower_bounds(distances, self.radii[[left, right]])
+        if np.count_nonzero(distances[:, 0] < distances[:, 1]) * 2 >= queries.size:
+            stack.append((right, queries, bounds[:, 1]))
+            stack.append((left, queries, bounds[:, 0]))
         else:
-            left_distance = self.metric(self.left.pivot, reference)
-            right_distance = self.metric(self.right.pivot, reference)
+            stack.append((left, queries, bounds[:, 0]))
+            stack.append((right, queries, bounds[:, 1]))
+
+    def find_k_nearest(self, k, reference):
+        indices = self.query(reference, k, return_distance=False)[0]
+        return list(indices) if self.labels is None else [self.labels[ix] for ix in indices]
+
+    def query_radius(self, points, radius, return_distance=False, count_only=False, n_jobs=1, backend='process'):
+        """Finds all points within radius of every row of points. Returns an array of neighbour counts
+        if count_only, otherwise an object array of neighbour index arrays (and one of distances)."""
+        if resolve_n_jobs(n_jobs) > 1:
+            return self._sharded('_query_radius', points, n_jobs, backend, radius, return_distance, count_only)
+        return self._query_radius(points, radius, return_distance, count_only)
+
+    def _query_radius(self, points, radius, return_distance, count_only):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, self.points.shape[1])
+        query_num = points.shape[0]
+        counts = np.zeros(query_num, dtype=np.intp)
+        found = []
 
-            if left_distance < right_distance:
-                first, second = self.left, self.right
-                first_distance, second_distance = left_distance, right_distance
+        root_distances = self.pairwise(points, self.pivots[:1])[:, 0] if query_num > 0 else np.zeros(0)
+        stack = [(0, np.arange(query_num), root_distances)]
+        while stack:
+            node, queries, pivot_distances = stack.pop()
+            near = self.lower_bounds(pivot_distances, self.radii[node]) <= radius
+            queries, pivot_distances = queries[near], pivot_distances[near]
+            if queries.size == 0:
+                continue
+
+            start, end = self.bounds[node]
+            upper_bounds = self.upper_bounds(pivot_distances, self.radii[node])
+            if not return_distance and upper_bounds is not None:
+                inside = upper_bounds <= radius
+                if inside.any():
+                    counts[queries[inside]] += end - start
+                    if not count_only:
+                        found.append(_pairs(queries[inside], self.indices[start:end]))
+                    queries, pivot_distances = queries[~inside], pivot_distances[~inside]
+                    if queries.size == 0:
+                        continue
+
+            if self.is_leaf(node):
+                distances = self.pairwise(points[queries], self.points[start:end])
+                within = distances <= radius
+                counts[queries] += within.sum(axis=1)
+                if not count_only:
+                    query_pos, point_pos = within.nonzero()
+                    found.append((queries[query_pos], self.indices[start + point_pos], distances[within]))
             else:
-                first, second = self.right, self.left
-                first_distance, second_distance = right_distance, left_distance
+                for child in self.children[node][::-1]:
+                    stack.append((child, queries, self.pairwise(points[queries], self.pivots[child:child + 1])[:, 0]))
+
+        if count_only:
+            return counts
+        return _group_pairs(query_num, counts, found, return_distance)
+
+    def _check_compatible(self, other):
+        if other.metric != self.metric or other.points.shape[1] != self.points.shape[1]:
+            raise ValueError('both trees need the same metric and dimensionality')
+
+    def _dual_nodes(self, other, bound, inside=None, k=None):
+        """Depth first traversal of pairs of nodes of other tree and this one. Every node of other carries
+        the nodes of this tree its points may need, pairs are pruned when the lower bound of both balls
+        exceeds bound(other_node) and surviving nodes of this tree are replaced by their children until
+        they are no larger than the node of other. Yields (other_node, leaves, lower bounds) for nodes of
+        other holding at most DUAL_BLOCK_SIZE points. Nodes of this tree entirely within the bound are
+        passed to inside(other_node, nodes) instead if it's given and the metric has upper bounds.
+        With k the bound is also lowered to the distance within which the nodes surely hold k points."""
+        stack = [(0, np.zeros(1, dtype=np.intp))] if other.size() > 0 and self.size() > 0 else []
+        while stack:
+            other_node, nodes = stack.pop()
+            other_start, other_end = other.bounds[other_node]
+            other_pivot, other_radius = other.pivots[other_node:other_node + 1], other.radii[other_node]
+            block = other.is_leaf(other_node) or other_end - other_start <= DUAL_BLOCK_SIZE
+            limit = bound(other_node)
+            while True:
+                distances = self.pairwise(other_pivot, self.pivots[nodes])[0]
+                lower = self.lower_bounds(distances, other_radius, self.radii[nodes])
+                if k is not None and self.exponent is not None:
+                    upper = self.upper_bounds(distances, other_radius, self.radii[nodes])
+                    order = np.argsort(upper)
+                    held = np.cumsum(self.bounds[nodes[order], 1] - self.bounds[nodes[order], 0])
+                    enough = np.searchsorted(held, k)
+                    if enough < order.size:
+                        limit = min(limit, upper[order[enough]])
+                near = lower <= limit
+                nodes, distances, lower = nodes[near], distances[near], lower[near]
+                if inside is not None:
+                    upper = self.upper_bounds(distances, other_radius, self.radii[nodes])
+                    if upper is not None and (upper <= limit).any():
+                        whole = upper <= limit
+                        inside(other_node, nodes[whole])
+                        nodes, distances, lower = nodes[~whole], distances[~whole], lower[~whole]
+
+                expand = self.children[nodes, 0] >= 0
+                if not block:
+                    expand &= self.radii[nodes] > other_radius
+                if not expand.any():
+                    break
+                nodes = np.concatenate([nodes[~expand], self.children[nodes[expand]].ravel()])
+
+            if nodes.size == 0:
+                continue
+            if block:
+                yield other_node, nodes, lower
+            else:
+                stack.extend((child, nodes) for child in other.children[other_node][::-1])
+
+    def _leaf_positions(self, leaves):
+        """Positions in self.points of all points stored in given leaves."""
+        starts, ends = self.bounds[leaves, 0], self.bounds[leaves, 1]
+        sizes = ends - starts
+        return np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+
+    def query_dual(self, other, k=1, return_distance=True):
+        """k nearest neighbours in this tree of all points of other tree. Pairs of nodes of both trees are
+        pruned by the bounds of both balls against the largest k-th distance found for the node of other,
+        the leaves remaining for blocks of other are searched closest first. Rows follow the original
+        order of other's points."""
+        self._check_compatible(other)
+        k = min(k, self.size())
+        best_distances = np.full((other.size(), k), np.inf)  # rows in the order of other.points
+        best_indices = np.full((other.size(), k), -1, dtype=np.intp)
+
+        def bound(other_node):
+            """Largest k-th distance in the node, or the smallest one plus its diameter if that's smaller."""
+            other_start, other_end = other.bounds[other_node]
+            kth_distances = best_distances[other_start:other_end].max(axis=1)
+            through_neighbour = self.upper_bounds(kth_distances.min(), other.radii[other_node], other.radii[other_node])
+            if through_neighbour is None:
+                return kth_distances.max()
+            return min(kth_distances.max(), through_neighbour)
+
+        for other_node, leaves, bounds in (self._dual_nodes(other, bound, k=k) if k > 0 else ()):
+            other_start, other_end = other.bounds[other_node]
+            block = slice(other_start, other_end)
+            order = np.argsort(bounds, kind='stable')
+            leaves, bounds = leaves[order], bounds[order]
+            # bounds of single points of the block are checked before computing distances to leaves
+            point_bounds = self.lower_bounds(self.pairwise(other.points[block], self.pivots[leaves]), self.radii[leaves])
+            for chunk_start in range(0, leaves.size, DUAL_LEAF_CHUNK):
+                chunk = slice(chunk_start, chunk_start + DUAL_LEAF_CHUNK)
+                kth_distances = best_distances[block].max(axis=1)
+                if bounds[chunk_start] > kth_distances.max():
+                    break
+                rows = other_start + np.flatnonzero((point_bounds[:, chunk] <= kth_distances[:, None]).any(axis=1))
+                if rows.size == 0:
+                    continue
+                positions = self._leaf_positions(leaves[chunk])
+                distances = self.pairwise(other.points[rows], self.points[positions])
+                best_distances[rows], best_indices[rows] = merge_nearest(
+                    best_distances[rows], best_indices[rows], distances,
+                    np.broadcast_to(self.indices[positions], distances.shape), k
+                )
+
+        order = np.argsort(best_distances, axis=1, kind='stable')
+        result_distances = np.empty_like(best_distances)
+        result_indices = np.empty_like(best_indices)
+        result_distances[other.indices] = np.take_along_axis(best_distances, order, axis=1)
+        result_indices[other.indices] = np.take_along_axis(best_indices, order, axis=1)
+        if not return_distance:
+            return result_indices
+        return result_distances, result_indices
+
+    def query_radius_dual(self, other, radius, return_distance=False, count_only=False):
+        """All pairs within radius between points of other tree and this one, results as in query_radius
+        for other's points in their original order. Pairs of balls entirely within radius are counted
+        without computing any distances unless these are requested."""
+        self._check_compatible(other)
+        counts = np.zeros(other.size(), dtype=np.intp)
+        found = []
+
+        def inside(other_node, nodes):
+            other_start, other_end = other.bounds[other_node]
+            positions = self._leaf_positions(nodes)
+            counts[other_start:other_end] += positions.size
+            if not count_only:
+                found.append(_pairs(other.indices[other_start:other_end], self.indices[positions]))
+
+        pairs = self._dual_nodes(other, lambda other_node: radius, None if return_distance else inside)
+        for other_node, leaves, _ in pairs:
+            other_start, other_end = other.bounds[other_node]
+            block = slice(other_start, other_end)
+            positions = self._leaf_positions(leaves)
+            distances = self.pairwise(other.points[block], self.points[positions])
+            within = distances <= radius
+            counts[block] += within.sum(axis=1)
+            if not count_only:
+                other_pos, pos = within.nonzero()
+                found.append((other.indices[other_start + other_pos], self.indices[positions[pos]], distances[within]))
+
+        result_counts = np.empty_like(counts)
+        result_counts[other.indices] = counts
+        if count_only:
+            return result_counts
+        return _group_pairs(other.size(), result_counts, found, return_distance)
+
+
+def query_shared(path, method, points, args):
+    tree = BallTree.from_arrays(*load_shared(path))
+    return getattr(tree, method)(points, *args)
+
+
+def _pairs(queries, indices):
+    return np.repeat(queries, indices.size), np.tile(indices, queries.size), None
+
+
+def _group_pairs(query_num, counts, found, return_distance):
+    """Turns (query, index, distance) triples into per query arrays sorted by index."""
+    queries = np.concatenate([pair[0] for pair in found] + [np.zeros(0, dtype=np.intp)])
+    indices = np.concatenate([pair[1] for pair in found] + [np.zeros(0, dtype=np.intp)])
+    order = np.lexsort((indices, queries))
+    splits = np.cumsum(counts)[:-1]
+
+    result_indices = _object_array(np.split(indices[order], splits))
+    if not return_distance:
+        return result_indices
+    distances = np.concatenate([pair[2] for pair in found] + [np.zeros(0)])
+    return result_indices, _object_array(np.split(distances[order], splits))
+
+
+def _object_array(parts):
+    result = np.empty(len(parts), dtype=object)
+    for i, part in enumerate(parts):
+        result[i] = part
+    return result
+
 
-            if first_distance - first.radius <= -best[0][0]:
-                first._find_k_nearest(k, reference, best)
-            if second_distance - second.radius <= -best[0][0]:
-                second._find_k_nearest(k, reference, best)
+def merge_nearest(best_distances, best_indices, distances, indices, k):
+    """Keeps the k smallest distances of each row from both the current best and new candidates."""
+    distances = np.concatenate([best_distances, distances], axis=1)
+    indices = np.concatenate([best_indices, indices], axis=1)
+    if distances.shape[1] > k:
+        chosen = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, chosen, axis=1)
+        indices = np.take_along_axis(indices, chosen, axis=1)
+    return distances, indices
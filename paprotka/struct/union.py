@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Union:
     def __init__(self, value=None):
         self.root = None
@@ -26,3 +29,59 @@ class Union:
             self.root = self.root.resolve()
             return self.root
         return self
+
+
+class DisjointSet:
+    """Disjoint sets of elements 0..size - 1 kept in parent and rank arrays."""
+
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.intp)
+        self.rank = np.zeros(size, dtype=np.int32)
+
+    def __len__(self):
+        return self.parent.size
+
+    def find(self, element):
+        root = element
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[element] != root:
+            self.parent[element], element = root, self.parent[element]
+        return root
+
+    def union(self, first, second):
+        """Merges sets of two elements by rank, returns the root of the merged set."""
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return first
+        if self.rank[first] < self.rank[second]:
+            first, second = second, first
+        self.parent[second] = first
+        if self.rank[first] == self.rank[second]:
+            self.rank[first] += 1
+        return first
+
+    def same(self, first, second):
+        return self.find(first) == self.find(second)
+
+    def find_all(self, elements=None):
+        """Roots of many elements, all of them by default. Every element is pointed to its grandparent
+        until all point to their roots, which halves the depth of all trees in each step."""
+        parent = self.parent
+        while True:
+            grandparents = parent[parent]
+            if np.array_equal(grandparents, parent):
+                break
+            parent = grandparents
+        self.parent = parent
+        return parent.copy() if elements is None else parent[np.asarray(elements, dtype=np.intp)]
+
+    def union_pairs(self, firsts, seconds):
+        """Merges sets of elements of all pairs at once, hooking roots onto the smallest roots they are paired
+        with until every pair shares its root. Sets merged only this way are rooted at their smallest element."""
+        firsts, seconds = np.asarray(firsts, dtype=np.intp), np.asarray(seconds, dtype=np.intp)
+        while firsts.size > 0:
+            firsts, seconds = self.find_all(firsts), self.find_all(seconds)
+            different = firsts != seconds
+            firsts, seconds = firsts[different], seconds[different]
+            np.minimum.at(self.parent, np.maximum(firsts, seconds), np.minimum(firsts, seconds))
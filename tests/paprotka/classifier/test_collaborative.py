@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from paprotka.classifier.collaborative import CollaborativeRecommender
+
+
+def make_ratings(random, users=40, items=30, rank=2, count=600):
+    user_factors = random.rand(users, rank)
+    item_factors = random.rand(items, rank) * 2
+    pairs = np.unique(np.c_[random.randint(0, users, count), random.randint(0, items, count)], axis=0)
+    ratings = np.einsum('ij,ij->i', user_factors[pairs[:, 0]], item_factors[pairs[:, 1]])
+    train_df = pd.DataFrame({'person_id': pairs[:, 0] + 100, 'movie_id': pairs[:, 1] + 1})
+    return train_df, pd.Series(ratings)
+
+
+def should_fit_observed_ratings_only():
+    random = np.random.RandomState(0)
+    train_df, label_df = make_ratings(random)
+
+    np.random.seed(0)
+    model = CollaborativeRecommender(feature_count=2, error_ratio_threshold=1e-7)
+    model.fit(train_df, label_df)
+
+    users = np.array([model.person_pos[person_id] for person_id in train_df.person_id])
+    predictions = model._predict_observed(users, train_df.movie_id.values - 1)
+    assert np.sqrt(np.mean(np.square(predictions - label_df.values))) < 0.2
+
+
+def should_recommend_best_unrated_movies():
+    random = np.random.RandomState(1)
+    train_df, label_df = make_ratings(random)
+    np.random.seed(1)
+    model = CollaborativeRecommender(feature_count=2)
+    model.fit(train_df, label_df)
+
+    person_ids = np.array([100, 117, 139])
+    recommendations = model.recommend(person_ids, n=4, block_bytes=1024)
+    for person_id, movie_ids in zip(person_ids, recommendations):
+        scores = model.user_params[model.person_pos[person_id]] @ model.item_features.T
+        scores[train_df.movie_id[train_df.person_id == person_id].values - 1] = -np.inf
+        assert np.array_equal(np.argsort(-scores)[:4] + 1, movie_ids)
+
+    task_df = train_df.iloc[::7]
+    expected = np.clip(np.round(model._predict_observed(
+        model.positions(task_df.person_id), task_df.movie_id.values - 1)), 0, 5)
+    assert np.array_equal(model.predict(task_df).values, expected)
+
+
+def should_learn_from_streamed_chunks():
+    random = np.random.RandomState(2)
+    train_df, label_df = make_ratings(random, count=2000)
+    order = random.permutation(len(train_df))
+    train_df, label_df = train_df.iloc[order], label_df.iloc[order]
+
+    np.random.seed(2)
+    model = CollaborativeRecommender(feature_count=2)
+    model.partial_fit(train_df[:200], label_df[:200], max_iter=50)
+    for epoch in range(20):
+        for start in range(0, len(train_df), 300):
+            model.partial_fit(train_df[start:start + 300], label_df[start:start + 300], max_iter=5)
+
+    assert np.array_equal(np.sort(model.person_ids), np.unique(train_df.person_id))
+    assert model.rated.nnz == len(train_df)
+    predictions = model._predict_observed(model.positions(train_df.person_id), train_df.movie_id.values - 1)
+    assert np.sqrt(np.mean(np.square(predictions - label_df.values))) < 0.05
+
+    untouched = model.user_params[model.person_pos[100]].copy()
+    new_df = pd.DataFrame({'person_id': [1, 1], 'movie_id': [2, train_df.movie_id.max() + 5]})
+    model.partial_fit(new_df, pd.Series([1.0, 2.0]))
+    assert model.person_ids[-1] == 1 and model.item_features.shape[0] == train_df.movie_id.max() + 5
+    assert model.rated[model.positions([1])].nnz == 2 and model.rated.nnz == len(train_df) + 2
+    assert np.array_equal(untouched, model.user_params[model.person_pos[100]])
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+from paprotka.classifier import decision_tree as dt
+
+
+def make_data(random, size=300):
+    features = pd.DataFrame(np.round(random.randn(size, 4), 1), columns=list('abcd'))
+    labels = (features.a + features.b * features.c > 0).astype(int).values + (features.d > 1)
+    return features, labels
+
+
+def should_find_same_division_as_exhaustive_search():
+    features, labels = make_data(np.random.RandomState(0))
+    unique_labels, codes = np.unique(labels, return_inverse=True)
+
+    expected = None
+    for column in range(features.shape[1]):
+        series = features.values[:, column]
+        for division in dt.find_dividing_points(series):
+            lesser = series < division
+            if min(lesser.sum(), (~lesser).sum()) < 5:
+                continue
+            percentage = lesser.mean()
+            score = (percentage * dt.gini(np.bincount(codes[lesser], minlength=3))
+                     + (1 - percentage) * dt.gini(np.bincount(codes[~lesser], minlength=3)))
+            if expected is None or score < expected[0]:
+                expected = (score, column, division)
+
+    score, column, division, _, _ = dt.find_best_division(features.values, codes, 3, dt.gini, 5)
+    assert np.isclose(score, expected[0]) and column == expected[1] and np.isclose(division, expected[2])
+
+
+def should_fit_training_data():
+    features, labels = make_data(np.random.RandomState(1))
+    for criterion in dt.DecisionTreeClassifier.CRITERIA:
+        model = dt.DecisionTreeClassifier(criterion, 'best')
+        model.fit(features, labels)
+        assert np.array_equal(model.predict(features).values, labels)
+
+
+def should_predict_with_node_arrays(tmpdir):
+    features, labels = make_data(np.random.RandomState(2), 500)
+    model = dt.DecisionTreeClassifier('entropy', 'best', min_samples_leaf=10)
+    model.fit(features[:400], labels[:400])
+
+    expected = features[400:].apply(model.tree.classify, axis=1).values
+    assert np.array_equal(model.predict(features[400:]).values, expected)
+    assert np.array_equal(model.predict(features[400:].values), expected)
+    assert model.value[0].sum() == 400
+
+    path = str(tmpdir.join('tree.arrays'))
+    model.save(path)
+    loaded = dt.DecisionTreeClassifier.load(path)
+    assert np.array_equal(loaded.predict(features[400:][['d', 'c', 'b', 'a']]).values, expected)
+
+
+def should_save_string_labels(tmpdir):
+    features, labels = make_data(np.random.RandomState(4))
+    names = pd.Series(np.array(['low', 'middle', 'high'], dtype=object)[labels])
+    model = dt.DecisionTreeClassifier('gini', 'best', min_samples_leaf=5)
+    model.fit(features, names)
+
+    path = str(tmpdir.join('tree.arrays'))
+    model.save(path)
+    loaded = dt.DecisionTreeClassifier.load(path)
+
+    assert np.array_equal(loaded.predict(features).values, model.predict(features).values)
+    assert set(loaded.predict(features)) <= {'low', 'middle', 'high'}
+
+
+def should_keep_labels_of_other_types(tmpdir):
+    features, labels = make_data(np.random.RandomState(5))
+    flags = pd.Series(labels > 0, dtype=object)
+    model = dt.DecisionTreeClassifier('gini', 'best')
+    model.fit(features, flags)
+
+    predictions = model.predict(features)
+    assert all(isinstance(prediction, bool) for prediction in predictions)
+    assert np.array_equal(predictions.values, flags.values)
+    with pytest.raises(ValueError):
+        model.save(str(tmpdir.join('tree.arrays')))
+
+
+def should_split_histograms_like_sorted_columns():
+    features, labels = make_data(np.random.RandomState(3), 2000)
+    best = dt.DecisionTreeClassifier('gini', 'best', min_samples_leaf=3, max_depth=6)
+    best.fit(features, labels)
+    hist = dt.DecisionTreeClassifier('gini', 'hist', min_samples_leaf=3, max_depth=6, n_jobs=2)
+    hist.fit(features, labels)
+
+    # every column has less than 256 distinct values, so both find the same partitions
+    assert np.array_equal(best.feature, hist.feature)
+    assert np.array_equal(best.value, hist.value)
+    assert np.array_equal(best.apply(features), hist.apply(features))
+    assert best.tree.count_depth() == 7
+
+    shallow = dt.DecisionTreeClassifier('entropy', 'hist', max_bins=16, min_samples_split=500)
+    shallow.fit(features, labels)
+    internal = shallow.feature >= 0
+    assert (shallow.value[internal].sum(axis=1) >= 500).all()
@@ -0,0 +1,75 @@
+import math
+import numpy as np
+from paprotka.classifier import dtw
+from paprotka.metric import METRICS
+
+
+def naive_dtw(pattern, sequence, lo=None, hi=None):
+    metric = METRICS['euclidean']
+    table = np.full((len(sequence) + 1, len(pattern) + 1), math.inf)
+    table[0, 0] = 0
+    for i in range(len(sequence)):
+        for j in range(len(pattern)) if lo is None else range(lo[i], hi[i]):
+            table[i + 1, j + 1] = metric(pattern[j], sequence[i]) + min(table[i, j], table[i, j + 1], table[i + 1, j])
+    return table[-1, -1]
+
+
+def should_match_naive_dtw_with_both_kernels():
+    random = np.random.RandomState(0)
+    pattern = random.randn(17, 3)
+    sequence = random.randn(29, 3)
+    expected = naive_dtw(pattern, sequence)
+
+    pairwise = dtw.get_pairwise_metric('euclidean')
+    for kernel in [dtw.accumulate_banded, dtw.accumulate_banded_numpy]:
+        lo, hi = dtw.make_window(29, 17)
+        assert np.isclose(kernel(dtw.banded_cost(pairwise, pattern, sequence, lo, hi), lo, hi, math.inf), expected)
+
+        lo, hi = dtw.make_window(29, 17, window=3, slope=2)
+        assert np.isclose(kernel(dtw.banded_cost(pairwise, pattern, sequence, lo, hi), lo, hi, math.inf),
+                          naive_dtw(pattern, sequence, lo, hi))
+
+
+def should_return_path_consistent_with_distance():
+    random = np.random.RandomState(1)
+    pattern = random.randn(12, 2)
+    sequence = random.randn(20, 2)
+
+    distance, path = dtw.calculate_dtw('euclidean', pattern, sequence, window=4, slope=2, return_path=True)
+
+    assert path[0] == (0, 0) and path[-1] == (11, 19)
+    assert np.isclose(distance, sum(METRICS['euclidean'](pattern[i], sequence[j]) for i, j in path))
+    assert distance >= dtw.calculate_dtw('euclidean', pattern, sequence)
+    assert dtw.calculate_dtw('euclidean', pattern, sequence, cutoff=distance / 10) == math.inf
+
+
+def should_predict_same_labels_with_pruning():
+    random = np.random.RandomState(2)
+    patterns = [np.cumsum(random.randn(random.randint(8, 20), 2), axis=0) for _ in range(30)]
+    labels = np.arange(30)
+    queries = [pattern[::2] + random.randn(*pattern[::2].shape) * 0.1 for pattern in patterns[:10]]
+
+    for window in [None, 3]:
+        classifier = dtw.DynamicTimeWarpingClassifier(window=window)
+        classifier.fit(patterns, labels)
+
+        distances = np.array([[dtw.calculate_dtw('euclidean', pattern, query, window) for pattern in patterns]
+                              for query in queries])
+        assert np.array_equal(classifier.predict(queries), labels[np.argmin(distances, axis=1)])
+
+
+def should_compute_symmetric_matrix_in_parallel(tmpdir):
+    random = np.random.RandomState(3)
+    sequences = [random.randn(random.randint(5, 15), 2) for _ in range(9)]
+    cache = str(tmpdir.join('matrix'))
+
+    distances = dtw.calculate_dtw_matrix('euclidean', sequences, n_jobs=2, cache=cache)
+
+    expected = [[dtw.calculate_dtw('euclidean', first, second) for second in sequences] for first in sequences]
+    assert np.allclose(distances, expected)
+    assert np.array_equal(dtw.calculate_dtw_matrix('euclidean', sequences, cache=cache), distances)
+
+    others = [random.randn(len(sequence), 2) for sequence in sequences]
+    expected = [[dtw.calculate_dtw('euclidean', first, second) for second in others] for first in others]
+    assert np.allclose(dtw.calculate_dtw_matrix('euclidean', others, cache=cache), expected)
+    assert 'first' not in dtw._worker_state
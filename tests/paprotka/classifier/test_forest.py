@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+from paprotka.classifier.forest import RandomForestClassifier
+
+
+def should_grow_same_forest_in_parallel():
+    random = np.random.RandomState(0)
+    features = pd.DataFrame(random.randn(1500, 6), columns=list('abcdef'))
+    labels = (features.a + features.b * features.c + random.randn(1500) * 0.3 > 0).astype(int).values
+    train, test = slice(0, 1000), slice(1000, None)
+
+    forest = RandomForestClassifier(8, random_state=1, chunk_size=128, min_samples_leaf=2)
+    forest.fit(features[train], labels[train])
+    predictions = forest.predict(features[test])
+    assert (predictions.values == labels[test]).mean() > 0.8
+    assert len({tree.feature.size for tree in forest.trees}) > 1
+
+    for backend in ('process', 'thread'):
+        parallel = RandomForestClassifier(8, random_state=1, n_jobs=2, backend=backend, min_samples_leaf=2)
+        parallel.fit(features[train], labels[train])
+        assert np.array_equal(parallel.predict(features[test].values), predictions.values)
+
+    hist = RandomForestClassifier(8, splitter='hist', max_features=0.5, random_state=1, max_bins=32)
+    hist.fit(features[train], labels[train])
+    assert (hist.predict(features[test]).values == labels[test]).mean() > 0.8
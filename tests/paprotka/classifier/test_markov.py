@@ -0,0 +1,74 @@
+import itertools as it
+import numpy as np
+from paprotka.classifier.markov import DiscreteHMM, HMMGMMClassifier, score_sequences
+
+
+def make_model():
+    a = np.array([[0.7, 0.2, 0.1], [0.1, 0.8, 0.1], [0.3, 0.0, 0.7]])
+    b = np.array([[0.5, 0.4, 0.1], [0.1, 0.1, 0.8], [0.3, 0.6, 0.1]])
+    initial = np.array([0.5, 0.3, 0.2])
+    return DiscreteHMM(a, b, initial), a, b, initial
+
+
+def path_probability(a, b, initial, states, observations):
+    probability = initial[states[0]] * b[states[0], observations[0]]
+    for previous, state, observation in zip(states, states[1:], observations[1:]):
+        probability *= a[previous, state] * b[state, observation]
+    return probability
+
+
+def should_match_enumerated_paths_for_ragged_batch():
+    model, a, b, initial = make_model()
+    sequences = [np.array([0, 2, 1, 1]), np.array([2]), np.array([1, 0, 2])]
+
+    scores = model.score(sequences)
+    paths, path_scores = model.decode(sequences)
+
+    for i, observations in enumerate(sequences):
+        probabilities = {states: path_probability(a, b, initial, states, observations)
+                         for states in it.product(range(3), repeat=len(observations))}
+        best = max(probabilities, key=probabilities.get)
+        assert np.isclose(scores[i], np.log(sum(probabilities.values())))
+        assert np.isclose(path_scores[i], np.log(probabilities[best]))
+        assert tuple(paths[i, :len(observations)]) == best
+
+
+def should_not_underflow_on_long_sequences():
+    model, _, _, _ = make_model()
+    sequence = np.random.RandomState(0).randint(0, 3, 5000)
+
+    score = model.score([sequence])[0]
+    posteriors = np.exp(model.posteriors([sequence])[0])
+
+    assert np.isfinite(score) and score < -1000
+    assert np.allclose(posteriors.sum(axis=1), 1)
+
+
+def should_score_sequences_like_hmmlearn():
+    random = np.random.RandomState(0)
+    features = [random.randn(random.randint(20, 40), 2) + (i % 2) * 3 for i in range(12)]
+    labels = np.array(['low', 'high'] * 6)
+
+    classifier = HMMGMMClassifier(n_jobs=2, chunk_size=5)
+    classifier.fit(features, labels, n_components=2, n_mix=1, random_state=0)
+    predictions, scores = classifier.predict(features, return_scores=True)
+
+    expected = [[model.score(sequence) for model in classifier.models] for sequence in features]
+    assert np.allclose(scores, expected)
+    assert np.array_equal(predictions, labels)
+
+
+class PublicScoreOnly:
+    def __init__(self, model):
+        self.score = model.score
+
+
+def should_fall_back_to_public_score():
+    random = np.random.RandomState(1)
+    features = [random.randn(random.randint(10, 20), 2) + (i % 2) * 3 for i in range(6)]
+    classifier = HMMGMMClassifier()
+    classifier.fit(features, np.array(['low', 'high'] * 3), n_components=2, n_mix=1, random_state=0)
+
+    scores = score_sequences([PublicScoreOnly(model) for model in classifier.models], features)
+
+    assert np.allclose(scores, score_sequences(classifier.models, features))
@@ -0,0 +1,53 @@
+import numpy as np
+from paprotka.classifier.naive_bayes import GaussianNB
+
+
+def should_learn_same_model_from_chunks():
+    random = np.random.RandomState(0)
+    labels = random.randint(0, 3, 600)
+    features = random.randn(600, 200) + labels[:, None]
+
+    first_class = labels[:50] == 0
+    chunked = GaussianNB()
+    chunked.partial_fit(features[:50][first_class], labels[:50][first_class], priors_equal=False)
+    for start in range(0, 600, 128):
+        chunked.partial_fit(features[start:start + 128], labels[start:start + 128], priors_equal=False)
+    whole = GaussianNB()
+    whole.fit(np.concatenate([features[:50][first_class], features]),
+              np.concatenate([labels[:50][first_class], labels]), priors_equal=False)
+
+    assert np.allclose(whole.means, chunked.means)
+    assert np.allclose(whole.variances, chunked.variances)
+    assert np.allclose(whole.priors, chunked.priors)
+    assert np.array_equal(whole.predict(features), chunked.predict(features))
+
+
+def should_not_underflow_with_many_features():
+    random = np.random.RandomState(1)
+    labels = random.randint(0, 2, 400)
+    features = random.randn(400, 2000) * 5 + labels[:, None]
+
+    model = GaussianNB(dtype=np.float32)
+    model.fit(features, labels)
+    log_proba = model.predict_log_proba(features)
+
+    assert np.all(np.isfinite(log_proba))
+    assert np.allclose(np.exp(log_proba).sum(axis=1), 1, atol=1e-4)
+    assert (model.predict(features) == labels).mean() > 0.95
+
+
+def should_stay_accurate_with_offset_features():
+    random = np.random.RandomState(2)
+    labels = random.randint(0, 2, 1000)
+    features = 1e4 + random.randn(1000, 20) + labels[:, None]
+
+    expected = GaussianNB()
+    expected.fit(features, labels)
+    model = GaussianNB(dtype=np.float32)
+    model.fit(features, labels)
+
+    likelihoods = model.joint_log_likelihood(features)
+    assert np.all(likelihoods < 0)
+    # float32 resolution of features around 1e4 is about 1e-3
+    assert np.allclose(likelihoods, expected.joint_log_likelihood(features), atol=0.1)
+    assert (model.predict(features) == expected.predict(features)).mean() > 0.99
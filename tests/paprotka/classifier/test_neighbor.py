@@ -0,0 +1,43 @@
+import numpy as np
+from paprotka.classifier.neighbor import KNeighborsClassifier, NearestCentroid, majority_vote
+
+
+def should_prefer_smallest_label_on_ties():
+    codes = np.array([[2, 1, 1, 2], [0, 3, 3, 0], [4, 4, 4, 1]])
+
+    assert np.array_equal(majority_vote(codes, 5), [1, 0, 4])
+
+
+def should_predict_same_labels_with_every_algorithm(tmpdir):
+    random = np.random.RandomState(0)
+    features = random.randn(3000, 4)
+    labels = np.where(features[:, 0] + features[:, 1] > 0, 'yes', 'no').reshape(-1, 1)
+    tests = random.randn(200, 4)
+
+    predictions = []
+    for algorithm in ['brute', 'ball_tree']:
+        classifier = KNeighborsClassifier(5, 'manhattan', algorithm, chunk_size=64)
+        classifier.fit(features, labels)
+        predictions.append(classifier.predict(tests))
+        path = str(tmpdir.join(algorithm))
+        classifier.save(path)
+        assert np.array_equal(KNeighborsClassifier.load(path).predict(tests), predictions[-1])
+
+    assert np.array_equal(predictions[0], predictions[1])
+
+
+def should_fit_same_centroids_from_chunks():
+    random = np.random.RandomState(0)
+    features = random.randn(300, 3)
+    labels = random.randint(0, 4, (300, 1))
+
+    whole = NearestCentroid()
+    whole.fit(features, labels)
+    chunked = NearestCentroid()
+    chunked.partial_fit(features[:100][labels[:100, 0] < 2], labels[:100][labels[:100, 0] < 2])
+    chunked.partial_fit(features[:100][labels[:100, 0] >= 2], labels[:100][labels[:100, 0] >= 2])
+    chunked.partial_fit(features[100:], labels[100:])
+
+    assert np.array_equal(whole.unique_labels, chunked.unique_labels)
+    assert np.allclose(whole.patterns, chunked.patterns)
+    assert np.array_equal(whole.predict(features), chunked.predict(features))
@@ -0,0 +1,50 @@
+import numpy as np
+from paprotka.classifier.parzen import Parzen
+
+
+def make_data(rows=300, dims=4, seed=0):
+    random = np.random.RandomState(seed)
+    labels = random.choice(['a', 'b', 'c'], rows)
+    features = random.randn(rows, dims) + (labels == 'b')[:, None] - 2 * (labels == 'c')[:, None]
+    return features, labels, random.randn(50, dims)
+
+
+def kernel_sums_per_label(classifier, tests):
+    features = classifier.normalize(tests)
+    kernels = np.exp((features @ classifier.features.T - 1) / classifier.variance)
+    return np.stack([kernels[:, classifier.labels == label].sum(axis=1) for label in classifier.unique_labels], axis=1)
+
+
+def should_sum_kernels_per_class_with_one_hot_matrix():
+    features, labels, tests = make_data()
+    classifier = Parzen()
+    classifier.fit(features, labels)
+
+    sums = classifier.class_sums(classifier.normalize(tests))
+
+    assert np.allclose(sums, kernel_sums_per_label(classifier, tests))
+
+
+def should_predict_same_labels_in_small_blocks():
+    features, labels, tests = make_data()
+    classifier = Parzen(block_bytes=300 * 16 * 7)  # 7 rows per block
+    classifier.fit(features, labels)
+
+    expected = classifier.unique_labels[np.argmax(kernel_sums_per_label(classifier, tests), axis=1)]
+
+    assert np.array_equal(classifier.predict(tests), expected)
+
+
+def should_sum_same_neighbours_with_tree_and_partition():
+    features, labels, tests = make_data()
+    with_tree = Parzen(block_bytes=300 * 16 * 7, n_neighbors=9)
+    with_tree.fit(features, labels)
+    without_tree = Parzen(block_bytes=300 * 16 * 7, n_neighbors=9)
+    without_tree.TREE_MAX_DIMS = 0
+    without_tree.fit(features, labels)
+    normalized = with_tree.normalize(tests)
+
+    assert with_tree.tree is not None and without_tree.tree is None
+    assert np.allclose(with_tree.class_sums(normalized), without_tree.class_sums(normalized))
+    assert np.all(with_tree.class_sums(normalized) <= kernel_sums_per_label(with_tree, tests) + 1e-12)
+    assert np.array_equal(with_tree.predict(tests), without_tree.predict(tests))
@@ -0,0 +1,26 @@
+import numpy as np
+from paprotka.feature.binary_pattern import interpolate_bilinear, local_binary_pattern, rotation_minimums
+
+
+def should_have_36_rotation_invariant_patterns():
+    minimums = rotation_minimums(8)
+    assert minimums.size == 256 and np.unique(minimums).size == 36
+    assert minimums[0b10000000] == 1 and minimums[0b11000011] == 0b00001111
+
+
+def should_match_single_pixel_patterns():
+    random = np.random.RandomState(0)
+    images = random.randint(0, 4, (2, 9, 11)).astype(np.uint8)
+    patterns = local_binary_pattern(images)
+    assert patterns.dtype == np.uint8
+
+    offsets = [(-0.70711, -0.70711), (-1, 0), (-0.70711, 0.70711), (0, 1),
+               (0.70711, 0.70711), (1, 0), (0.70711, -0.70711), (0, -1)]
+    for image, image_patterns in zip(images, patterns):
+        for y, x in [(0, 0), (4, 5), (8, 10), (3, 0)]:
+            bits = ''.join('1' if image[y, x] <= interpolate_bilinear(image, y + dy, x + dx) else '0'
+                           for dy, dx in offsets)
+            assert image_patterns[y, x] == rotation_minimums(8)[int(bits, 2)]
+
+    image = random.rand(15, 15)
+    assert np.array_equal(local_binary_pattern(np.rot90(image)), np.rot90(local_binary_pattern(image)))
@@ -0,0 +1,21 @@
+import numpy as np
+from paprotka.feature import moment as m
+
+
+def should_match_single_moments():
+    images = np.random.RandomState(0).rand(3, 14, 9)
+    center = np.array([[6.5, 4.0], [3.0, 2.5], [7.0, 7.0]])
+    raw, central, normalized = m.moment_table(images, 3, center)
+
+    for image, image_center, image_raw, image_central, image_normalized in zip(
+            images, center, raw, central, normalized):
+        central00 = m.central_moment(image, 0, 0)
+        for p, q in [(0, 0), (1, 0), (0, 1), (1, 1), (2, 1), (0, 3), (3, 2)]:
+            assert np.isclose(image_raw[p, q], m.moment(image, p, q))
+            assert np.isclose(image_central[p, q], m.central_moment(image, p, q, image_center))
+            assert np.isclose(image_normalized[p, q], m.scale_invariant(image, p, q, central00, image_center))
+
+    hu = m.hu_invariants(images)
+    assert hu.shape == (3, 7)
+    assert np.allclose(hu, [[invariant(image) for invariant in m.HU_INVARIANTS] for image in images],
+                       rtol=1e-9, atol=1e-15)
@@ -0,0 +1,31 @@
+import numpy as np
+from scipy import ndimage
+from paprotka.feature.morphology import label_components, label_unique
+
+
+def should_label_components_with_stats():
+    image = np.random.RandomState(0).rand(40, 50) < 0.55
+    for connectivity, structure in ((4, None), (8, np.ones((3, 3)))):
+        labels, stats = label_components(image, connectivity, return_stats=True)
+        expected, count = ndimage.label(image, structure)
+        assert labels.max() == count
+        assert np.unique(np.c_[labels[image], expected[image]], axis=0).shape[0] == count
+
+        first_pixels = [np.flatnonzero(labels.ravel() == label)[0] for label in range(1, count + 1)]
+        assert np.all(np.diff(first_pixels) > 0)
+        assert np.array_equal(stats['area'], np.bincount(labels.ravel())[1:])
+        assert np.array_equal(stats['bbox'], [(rows.start, cols.start, rows.stop, cols.stop)
+                                              for rows, cols in ndimage.find_objects(labels)])
+        assert np.allclose(stats['centroid'], ndimage.center_of_mass(image, labels, range(1, count + 1)))
+
+    assert np.array_equal(label_unique(image), np.where(labels > 0, labels + 1, 0))
+
+
+def should_label_tall_stripes():
+    image = np.zeros((32768, 16), dtype=bool)
+    image[:, ::2] = True
+
+    labels = label_components(image)
+
+    expected, count = ndimage.label(image)
+    assert np.array_equal(labels, expected) and count == 8
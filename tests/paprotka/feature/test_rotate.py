@@ -0,0 +1,45 @@
+import numpy as np
+from paprotka.feature import rotate
+from paprotka.feature.rotate import interpolate_bilinear, make_rotation_matrix, rotate_image
+
+
+def should_rotate_like_single_pixel_interpolation():
+    random = np.random.RandomState(0)
+    images = random.rand(3, 12, 17)
+    angle = 0.7
+    rotated = rotate_image(images, angle)
+    assert rotated.shape == images.shape
+
+    center = np.array([6, 8.5])
+    for image, image_rotated in zip(images, rotated):
+        for row, col in [(0, 0), (5, 7), (11, 16), (2, 13)]:
+            source = make_rotation_matrix(-angle) @ (np.array([row, col]) - center) + center
+            assert np.isclose(image_rotated[row, col], interpolate_bilinear(image, source)[0])
+
+
+def should_rotate_nearest_pixels():
+    image = np.arange(20.0).reshape(4, 5)
+    assert np.array_equal(rotate_image(image, 0, 'nearest'), image)
+    assert np.array_equal(rotate_image(image[None], 2 * np.pi, 'nearest')[0], image)
+    assert np.allclose(rotate_image(np.ones((6, 6)), 1.0), 1)
+
+
+def should_repeat_edges_of_non_negative_images():
+    image = np.arange(36.0).reshape(6, 6)
+    for angle in (0.5, 1.3, -2.0):
+        rotated = rotate_image(image, angle)
+        assert rotated.min() >= 0 and rotated.max() <= 35
+
+
+def should_bound_cached_gathers(monkeypatch):
+    monkeypatch.setattr(rotate, 'GATHER_CACHE_BYTES', 3 * 32 * 40 * 40)  # 32 bytes per pixel of a bilinear gather
+    monkeypatch.setattr(rotate, '_gather_cache', rotate.collections.OrderedDict())
+    image = np.random.RandomState(1).rand(40, 40)
+
+    for angle in np.linspace(0, 1, 10):
+        expected = rotate_image(image, angle)
+        assert np.array_equal(rotate_image(image, angle), expected)
+
+    positions, weights = rotate.rotation_gather((40, 40), 1.0)
+    assert positions.dtype == np.int32 and weights.dtype == np.float32
+    assert list(rotate._gather_cache) == [((40, 40), angle, 'bilinear') for angle in np.linspace(0, 1, 10)[-3:]]
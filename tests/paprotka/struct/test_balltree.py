@@ -0,0 +1,114 @@
+import os
+import numpy as np
+from paprotka.metric import pairwise_distances
+from paprotka.struct.balltree import BallTree
+
+
+def make_points(rows=500, dims=5, seed=0):
+    return np.random.RandomState(seed).randn(rows, dims)
+
+
+def should_find_same_neighbours_as_brute_force():
+    points = make_points()
+    queries = make_points(40, seed=1)
+
+    for metric in ['euclidean', 'manhattan', 'chebyshev']:
+        tree = BallTree(points, leaf_size=10, metric=metric, random_state=0)
+        distances, indices = tree.query(queries, k=7)
+
+        expected = np.sort(pairwise_distances(metric, queries, points), axis=1)[:, :7]
+        assert np.allclose(distances, expected)
+        assert indices.shape == (40, 7)
+
+
+def should_find_labels_of_stored_point():
+    points = make_points(100)
+    labels = np.arange(100) * 10
+    tree = BallTree(points, labels, leaf_size=4)
+
+    assert tree.find(points[42]) == [420]
+    assert tree.find(points[42] + 100) is None
+
+
+def should_answer_same_queries_after_loading(tmpdir):
+    points = make_points()
+    tree = BallTree(points, np.arange(500), leaf_size=10)
+    path = str(tmpdir.join('tree.bin'))
+
+    tree.save(path)
+    loaded = BallTree.load(path, mmap=True)
+
+    for expected, actual in zip(tree.query(points[:20], k=3), loaded.query(points[:20], k=3)):
+        assert np.array_equal(expected, actual)
+    assert loaded.find(points[7]) == [7]
+    for expected, actual in zip(tree.query(points[:20], k=3), loaded.query(points[:20], k=3, n_jobs=2)):
+        assert np.array_equal(expected, actual)
+    assert loaded.path == os.path.abspath(path)
+
+
+def should_find_same_radius_neighbours_as_brute_force():
+    points = make_points()
+    queries = make_points(30, seed=1)
+    tree = BallTree(points, leaf_size=10)
+    other = BallTree(queries, leaf_size=5)
+    distances = pairwise_distances('euclidean', queries, points)
+
+    indices, found_distances = tree.query_radius(queries, 2.5, return_distance=True)
+    dual_indices = tree.query_radius_dual(other, 2.5)
+
+    for i in range(30):
+        expected, = np.nonzero(distances[i] <= 2.5)
+        assert np.array_equal(indices[i], expected)
+        assert np.array_equal(dual_indices[i], expected)
+        assert np.allclose(found_distances[i], distances[i, expected])
+    assert np.array_equal(tree.query_radius(queries, 2.5, count_only=True), (distances <= 2.5).sum(axis=1))
+
+    for radius in [1.0, 4.0]:
+        dual_indices, dual_distances = tree.query_radius_dual(other, radius, return_distance=True)
+        counts = tree.query_radius_dual(other, radius, count_only=True)
+        assert np.array_equal(counts, (distances <= radius).sum(axis=1))
+        for i in range(30):
+            expected, = np.nonzero(distances[i] <= radius)
+            assert np.array_equal(dual_indices[i], expected)
+            assert np.allclose(dual_distances[i], distances[i, expected])
+
+
+def should_find_same_neighbours_with_dual_tree():
+    points = make_points()
+    queries = make_points(60, seed=1)
+    tree = BallTree(points, leaf_size=10)
+
+    distances, indices = tree.query_dual(BallTree(queries, leaf_size=5), k=4)
+
+    expected_distances, expected_indices = tree.query(queries, k=4)
+    assert np.allclose(distances, expected_distances)
+    assert np.array_equal(indices, expected_indices)
+
+
+def should_build_same_tree_in_parallel():
+    points = make_points(2000)
+    serial = BallTree(points, leaf_size=10, random_state=3)
+
+    for backend in ['thread', 'process']:
+        parallel = BallTree(points, leaf_size=10, random_state=3, n_jobs=3, backend=backend)
+
+        assert parallel.node_count() == serial.node_count()
+        assert np.array_equal(np.sort(parallel.radii), np.sort(serial.radii))
+        for expected, actual in zip(serial.query(points[:50], k=3),
+                                    parallel.query(points[:50], k=3, n_jobs=2, backend=backend)):
+            assert np.array_equal(expected, actual)
+
+
+def should_write_shared_archive_once_per_tree():
+    points = make_points(2000)
+    tree = BallTree(points, leaf_size=10)
+
+    first = tree.query(points[:50], k=3, n_jobs=2)
+    path = tree.path
+    second = tree.query(points[:50], k=3, n_jobs=2)
+
+    assert tree.path == path and os.path.exists(path)
+    for expected, actual in zip(first, second):
+        assert np.array_equal(expected, actual)
+    del tree
+    assert not os.path.exists(path)
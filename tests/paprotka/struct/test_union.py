@@ -0,0 +1,20 @@
+import numpy as np
+from paprotka.struct.union import DisjointSet
+
+
+def should_merge_pairs_like_single_unions():
+    random = np.random.RandomState(0)
+    firsts, seconds = random.randint(0, 500, 400), random.randint(0, 500, 400)
+
+    batch = DisjointSet(500)
+    batch.union_pairs(firsts, seconds)
+    single = DisjointSet(500)
+    for first, second in zip(firsts, seconds):
+        single.union(first, second)
+
+    batch_roots = batch.find_all()
+    single_roots = np.array([single.find(element) for element in range(500)])
+    assert np.unique(np.c_[batch_roots, single_roots], axis=0).shape[0] == np.unique(batch_roots).size
+    assert np.unique(batch_roots).size == np.unique(single_roots).size
+    for root in np.unique(batch_roots):
+        assert root == np.flatnonzero(batch_roots == root).min()
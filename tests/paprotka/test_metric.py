@@ -0,0 +1,22 @@
+import numpy as np
+from paprotka import metric
+
+
+def should_match_scalar_metrics_in_pairwise_distances():
+    random = np.random.RandomState(0)
+    first = random.randn(13, 4)
+    second = random.randn(7, 4)
+
+    for name, scalar in metric.METRICS.items():
+        expected = np.array([[scalar(x, y) for y in second] for x in first])
+        actual = metric.pairwise_distances(name, first, second, block_bytes=64)
+        assert np.allclose(actual, expected)
+
+
+def should_accept_scalar_metric_in_calculate_distances():
+    matrix = np.array([[0.0, 0.0], [1.0, 2.0], [3.0, -1.0]])
+    point = np.array([1.0, 1.0])
+
+    distances = metric.calculate_distances(metric.METRICS['manhattan'], matrix, point)
+
+    assert np.allclose(distances, [2, 1, 4])